@@ -0,0 +1,72 @@
+import os
+import json
+import time
+import threading
+
+
+def read_journal(journal_path):
+    entries = []
+    if not os.path.exists(journal_path):
+        return entries
+
+    with open(journal_path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # 비정상 종료로 잘린 마지막 줄은 버림
+                print(f"Ignoring truncated journal entry {journal_path}:{line_number}")
+                break
+    return entries
+
+
+class AnnotationJournal:
+    # Append-only log of label changes; fsync is batched across a commit interval
+    def __init__(self, journal_path, commit_interval=0.05):
+        self.journal_path = journal_path
+        self.commit_interval = commit_interval
+        self.entries = 0
+        self._file = open(journal_path, "a", encoding="utf-8")
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._committer = threading.Thread(
+            target=self._commit_loop, name="journal-commit", daemon=True
+        )
+        self._committer.start()
+
+    def append(self, op, **fields):
+        line = json.dumps({"ts": time.time(), "op": op, **fields}) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            self._dirty = True
+            self.entries += 1
+
+    def commit(self):
+        with self._lock:
+            if self._dirty:
+                os.fsync(self._file.fileno())
+                self._dirty = False
+
+    def rotate(self, rotated_path):
+        # 현재 저널을 rotated_path로 넘기고 빈 저널에서 다시 시작
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            os.replace(self.journal_path, rotated_path)
+            self._file = open(self.journal_path, "a", encoding="utf-8")
+            self._dirty = False
+            self.entries = 0
+
+    def close(self):
+        self._closed.set()
+        self._committer.join()
+        self.commit()
+        with self._lock:
+            self._file.close()
+
+    def _commit_loop(self):
+        while not self._closed.wait(self.commit_interval):
+            self.commit()
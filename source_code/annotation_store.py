@@ -0,0 +1,561 @@
+import os
+import csv
+import json
+import math
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from functools import partial
+from itertools import repeat
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from annotation_journal import AnnotationJournal, read_journal
+from snapshots import read_snapshot, is_diff_snapshot
+from patch_manifest import settle_mtime
+from functions import (
+    list_class_folders,
+    class_folder_signature,
+    list_class_files,
+    materialize_patch,
+    patch_path,
+)
+
+
+def format_classification(class_ids):
+    return ",".join(str(class_id) for class_id in sorted(class_ids))
+
+
+def parse_classification(classification):
+    # 빈 칸은 pandas에서 NaN, csv 모듈에서 ""로 읽힘
+    if classification is None or (
+        isinstance(classification, float) and math.isnan(classification)
+    ):
+        return set()
+    return {int(value) for value in str(classification).split(",") if value.strip()}
+
+
+class AnnotationStore(ABC):
+    # Backend interface: class ids are the numeric prefixes of the result folders
+    @abstractmethod
+    def rebuild(self, file_names, classifications):
+        pass
+
+    @abstractmethod
+    def file_names(self):
+        pass
+
+    @abstractmethod
+    def set_file_names(self, file_names):
+        pass
+
+    @abstractmethod
+    def add_label(self, file_name, class_id):
+        pass
+
+    @abstractmethod
+    def remove_label(self, file_name, class_id):
+        pass
+
+    @abstractmethod
+    def replace_class(self, class_id, file_names):
+        pass
+
+    @abstractmethod
+    def remove_class(self, class_id):
+        pass
+
+    @abstractmethod
+    def get_labels(self, file_name):
+        pass
+
+    @abstractmethod
+    def items(self):
+        # (file_name, sorted class ids) in patch order
+        pass
+
+    @abstractmethod
+    def get_folder_signatures(self):
+        pass
+
+    @abstractmethod
+    def set_folder_signatures(self, signatures):
+        pass
+
+    @contextmanager
+    def batch(self):
+        yield
+
+    def labeled_files(self):
+        return {file_name for file_name, class_ids in self.items() if class_ids}
+
+    def export_csv(self, csv_path):
+        import pandas as pd
+
+        file_names, classifications = [], []
+        for file_name, class_ids in self.items():
+            file_names.append(file_name)
+            classifications.append(format_classification(class_ids))
+
+        df = pd.DataFrame({"file_name": file_names, "classification": classifications})
+        df.to_csv(csv_path, index=False, encoding="utf-8")
+        return df
+
+    def close(self):
+        pass
+
+
+class CsvAnnotationStore(AnnotationStore):
+    # Snapshot CSV plus an append-only journal; the journal is folded into the
+    # snapshot in the background once it grows past compact_every entries
+    def __init__(self, csv_path, compact_every=5000, commit_interval=0.05):
+        self.csv_path = csv_path
+        self.signature_path = f"{csv_path}.folders.json"
+        self.journal_path = f"{csv_path}.journal"
+        self.compacting_path = f"{csv_path}.journal.compacting"
+        self.compact_every = compact_every
+        self.order = []
+        self.labels = {}
+        self.compaction = None
+
+        if os.path.exists(csv_path):
+            # 시작 경로에서 pandas를 불러오지 않도록 csv 모듈로 읽음
+            with open(csv_path, "r", encoding="utf-8", newline="") as f:
+                rows = list(csv.DictReader(f))
+            self.order = [row["file_name"] for row in rows]
+            self.labels = {
+                row["file_name"]: parse_classification(row["classification"])
+                for row in rows
+            }
+
+        # 스냅샷 + (중단된 압축의 저널) + 현재 저널 순서로 상태 복원
+        replayed = 0
+        for journal_path in (self.compacting_path, self.journal_path):
+            for entry in read_journal(journal_path):
+                self.apply_entry(entry)
+                replayed += 1
+
+        self.journal = AnnotationJournal(self.journal_path, commit_interval)
+        if replayed:
+            print(f"Replayed {replayed} journal entries")
+            self.write_snapshot(*self.capture())
+            self.journal.rotate(self.compacting_path)
+            os.remove(self.compacting_path)
+
+    def apply_entry(self, entry):
+        op = entry["op"]
+        if op == "add":
+            self.labels.setdefault(entry["file"], set()).add(entry["class_id"])
+        elif op == "remove":
+            self.labels.get(entry["file"], set()).discard(entry["class_id"])
+        elif op == "replace_class":
+            for class_ids in self.labels.values():
+                class_ids.discard(entry["class_id"])
+            for file_name in entry["files"]:
+                self.labels.setdefault(file_name, set()).add(entry["class_id"])
+        elif op == "remove_class":
+            for class_ids in self.labels.values():
+                class_ids.discard(entry["class_id"])
+
+    def record(self, op, **fields):
+        self.apply_entry({"op": op, **fields})
+        self.journal.append(op, **fields)
+        if self.journal.entries >= self.compact_every:
+            self.compact()
+
+    def capture(self):
+        return list(self.order), {
+            file_name: set(class_ids) for file_name, class_ids in self.labels.items()
+        }
+
+    def write_snapshot(self, order, labels):
+        tmp_path = f"{self.csv_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f, lineterminator="\n")
+            writer.writerow(["file_name", "classification"])
+            writer.writerows(
+                (file_name, format_classification(labels.get(file_name, ())))
+                for file_name in order
+            )
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.csv_path)
+
+    def compact(self, wait=False):
+        if self.compaction is not None and self.compaction.is_alive():
+            if not wait:
+                return
+            self.compaction.join()
+
+        # 회전 시점의 상태 = 기존 스냅샷 + 회전된 저널
+        order, labels = self.capture()
+        self.journal.rotate(self.compacting_path)
+
+        def fold():
+            self.write_snapshot(order, labels)
+            os.remove(self.compacting_path)
+
+        self.compaction = threading.Thread(target=fold, name="journal-compaction")
+        self.compaction.start()
+        if wait:
+            self.compaction.join()
+
+    def rebuild(self, file_names, classifications):
+        self.order = list(file_names)
+        self.labels = {
+            file_name: {
+                int(class_id) for class_id in classifications.get(file_name, [])
+            }
+            for file_name in file_names
+        }
+        self.compact(wait=True)
+
+    def file_names(self):
+        return list(self.order)
+
+    def set_file_names(self, file_names):
+        if file_names != self.order:
+            self.order = list(file_names)
+            self.compact()
+
+    def add_label(self, file_name, class_id):
+        self.record("add", file=file_name, class_id=int(class_id))
+
+    def remove_label(self, file_name, class_id):
+        self.record("remove", file=file_name, class_id=int(class_id))
+
+    def replace_class(self, class_id, file_names):
+        self.record("replace_class", files=list(file_names), class_id=int(class_id))
+
+    def remove_class(self, class_id):
+        self.record("remove_class", class_id=int(class_id))
+
+    def get_labels(self, file_name):
+        return sorted(self.labels.get(file_name, ()))
+
+    def items(self):
+        for file_name in self.order:
+            yield file_name, sorted(self.labels.get(file_name, ()))
+
+    def get_folder_signatures(self):
+        # 시그니처는 CSV 옆의 json 파일에 보관
+        if not os.path.exists(self.signature_path) or not os.path.exists(self.csv_path):
+            return {}
+        with open(self.signature_path, "r", encoding="utf-8") as f:
+            return {int(class_id): value for class_id, value in json.load(f).items()}
+
+    def set_folder_signatures(self, signatures):
+        with open(self.signature_path, "w", encoding="utf-8") as f:
+            json.dump(signatures, f)
+
+    def close(self):
+        if self.journal.entries:
+            self.compact(wait=True)
+        elif self.compaction is not None:
+            self.compaction.join()
+        self.journal.close()
+
+
+class SqliteAnnotationStore(AnnotationStore):
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self._depth = 0  # 열린 트랜잭션 중첩 수, 가장 바깥에서만 커밋
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS patches ("
+                "file_name TEXT PRIMARY KEY, position INTEGER NOT NULL)"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS labels ("
+                "file_name TEXT NOT NULL, class_id INTEGER NOT NULL, "
+                "PRIMARY KEY (file_name, class_id)) WITHOUT ROWID"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS labels_class ON labels (class_id)"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS class_folders ("
+                "class_id INTEGER PRIMARY KEY, signature TEXT NOT NULL)"
+            )
+
+    @contextmanager
+    def _transaction(self):
+        # batch() 안의 변경은 각자 커밋하지 않고 batch()가 끝날 때 한 번 커밋
+        with self._lock:
+            self._depth += 1
+            try:
+                if self._depth > 1:
+                    yield
+                else:
+                    with self.connection:
+                        yield
+            finally:
+                self._depth -= 1
+
+    @contextmanager
+    def batch(self):
+        with self._transaction():
+            yield
+
+    def rebuild(self, file_names, classifications):
+        with self._transaction():
+            self.connection.execute("DELETE FROM labels")
+            self.set_file_names(file_names)
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO labels (file_name, class_id) VALUES (?, ?)",
+                (
+                    (file_name, int(class_id))
+                    for file_name in file_names
+                    for class_id in classifications.get(file_name, [])
+                ),
+            )
+
+    def file_names(self):
+        with self._lock:
+            return [
+                row[0]
+                for row in self.connection.execute(
+                    "SELECT file_name FROM patches ORDER BY position"
+                )
+            ]
+
+    def set_file_names(self, file_names):
+        if self.file_names() == list(file_names):
+            return
+        with self._transaction():
+            self.connection.execute("DELETE FROM patches")
+            self.connection.executemany(
+                "INSERT INTO patches (file_name, position) VALUES (?, ?)",
+                (
+                    (file_name, position)
+                    for position, file_name in enumerate(file_names)
+                ),
+            )
+
+    def add_label(self, file_name, class_id):
+        with self._transaction():
+            self.connection.execute(
+                "INSERT OR IGNORE INTO labels (file_name, class_id) VALUES (?, ?)",
+                (file_name, int(class_id)),
+            )
+
+    def remove_label(self, file_name, class_id):
+        with self._transaction():
+            self.connection.execute(
+                "DELETE FROM labels WHERE file_name = ? AND class_id = ?",
+                (file_name, int(class_id)),
+            )
+
+    def replace_class(self, class_id, file_names):
+        with self._transaction():
+            self.connection.execute(
+                "DELETE FROM labels WHERE class_id = ?", (int(class_id),)
+            )
+            self.connection.executemany(
+                "INSERT INTO labels (file_name, class_id) VALUES (?, ?)",
+                ((file_name, int(class_id)) for file_name in file_names),
+            )
+
+    def remove_class(self, class_id):
+        with self._transaction():
+            self.connection.execute(
+                "DELETE FROM labels WHERE class_id = ?", (int(class_id),)
+            )
+
+    def get_labels(self, file_name):
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT class_id FROM labels WHERE file_name = ? ORDER BY class_id",
+                (file_name,),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def items(self):
+        with self._lock:
+            file_names = self.file_names()
+            labels = {}
+            for file_name, class_id in self.connection.execute(
+                "SELECT file_name, class_id FROM labels ORDER BY file_name, class_id"
+            ):
+                labels.setdefault(file_name, []).append(class_id)
+
+        for file_name in file_names:
+            yield file_name, labels.get(file_name, [])
+
+    def labeled_files(self):
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT DISTINCT file_name FROM labels"
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def get_folder_signatures(self):
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT class_id, signature FROM class_folders"
+            ).fetchall()
+        return {class_id: json.loads(signature) for class_id, signature in rows}
+
+    def set_folder_signatures(self, signatures):
+        with self._transaction():
+            self.connection.execute("DELETE FROM class_folders")
+            self.connection.executemany(
+                "INSERT INTO class_folders (class_id, signature) VALUES (?, ?)",
+                (
+                    (class_id, json.dumps(signature))
+                    for class_id, signature in signatures.items()
+                ),
+            )
+
+    def close(self):
+        with self._lock:
+            self.connection.close()
+
+
+def open_annotation_store():
+    backend = os.environ["ANNOTATION_BACKEND"]
+    if backend == "sqlite":
+        return SqliteAnnotationStore(os.environ["ANNOTATION_DB"])
+    if backend == "csv":
+        return CsvAnnotationStore(
+            os.environ["DATABASE"],
+            int(os.environ["JOURNAL_COMPACT_ENTRIES"]),
+            int(os.environ["JOURNAL_COMMIT_MS"]) / 1000,
+        )
+    raise ValueError(f"Unknown annotation backend: {backend}")
+
+
+def settle_signature(signature):
+    return [
+        [folder, settle_mtime(mtime_ns), size] for folder, mtime_ns, size in signature
+    ]
+
+
+def reconcile_annotation_store(store, image_files, results_path):
+    # Only class folders whose signature changed since the last run are listed
+    file_names = [os.path.basename(file_path) for file_path in image_files]
+    known = set(file_names)
+    class_folders = list_class_folders(results_path)
+    previous = store.get_folder_signatures()
+
+    signatures = {}
+    changed = []
+    for class_id, folders in class_folders.items():
+        signature = class_folder_signature(results_path, folders)
+        if previous.get(class_id) != signature:
+            changed.append(class_id)
+        signatures[class_id] = settle_signature(signature)
+
+    stored = set(previous)
+    if not previous:
+        # 첫 실행이거나 이전 버전의 DB: 시그니처가 없으므로 저장된 라벨에서 클래스를 모음
+        stored = {class_id for _, class_ids in store.items() for class_id in class_ids}
+
+    with store.batch():
+        store.set_file_names(file_names)
+        for class_id in sorted(stored - set(class_folders)):
+            store.remove_class(class_id)
+        for class_id in changed:
+            class_files = list_class_files(results_path, class_folders[class_id])
+            store.replace_class(class_id, sorted(class_files & known))
+        store.set_folder_signatures(signatures)
+
+    return changed
+
+
+def rebuild_annotation_store(
+    store, image_files, results_path, workers=8, executor_class=ThreadPoolExecutor
+):
+    # Full repair: every class folder is listed again, in parallel
+    file_names = [os.path.basename(file_path) for file_path in image_files]
+    class_folders = list_class_folders(results_path)
+
+    with executor_class(max_workers=workers) as executor:
+        members = dict(
+            zip(
+                class_folders,
+                executor.map(
+                    partial(list_class_files, results_path), class_folders.values()
+                ),
+            )
+        )
+
+    known = set(file_names)
+    classifications = {}
+    for class_id, class_files in members.items():
+        for file_name in class_files & known:
+            classifications.setdefault(file_name, []).append(class_id)
+
+    with store.batch():
+        store.rebuild(file_names, classifications)
+        store.set_folder_signatures(
+            {
+                class_id: settle_signature(
+                    class_folder_signature(results_path, folders)
+                )
+                for class_id, folders in class_folders.items()
+            }
+        )
+
+
+def export_class_folders(store, images_path, results_path, mode, executor=None):
+    # Writes every stored label into its class folder (used by the "virtual" mode)
+    class_folders = list_class_folders(results_path)
+    source_paths, target_paths = [], []
+
+    for file_name, class_ids in store.items():
+        for class_id in class_ids:
+            if class_id not in class_folders:
+                continue
+            target_path = os.path.join(
+                results_path, class_folders[class_id][0], file_name
+            )
+            if os.path.lexists(target_path):
+                continue
+            source_paths.append(patch_path(images_path, file_name))
+            target_paths.append(target_path)
+
+    if executor is None:
+        for source_path, target_path in zip(source_paths, target_paths):
+            materialize_patch(source_path, target_path, mode)
+    else:
+        list(executor.map(materialize_patch, source_paths, target_paths, repeat(mode)))
+
+    return len(target_paths)
+
+
+def read_label_file(csv_path):
+    # Database CSV (file_name, classification) or an Intermin_Saved snapshot
+    if is_diff_snapshot(csv_path):
+        return read_snapshot(csv_path)
+    import pandas as pd
+
+    df = pd.read_csv(csv_path, dtype=str, encoding="utf-8-sig")
+    if {"file_name", "classification"} <= set(df.columns):
+        return {
+            file_name: parse_classification(classification)
+            for file_name, classification in zip(df["file_name"], df["classification"])
+        }
+
+    return read_snapshot(csv_path)
+
+
+def sync_annotation_store(store, image_files, results_path):
+    if os.environ["MATERIALIZATION_MODE"] == "virtual":
+        # 가상 모드에서는 폴더가 비어 있을 수 있으므로 데이터베이스가 기준
+        store.set_file_names([os.path.basename(file_path) for file_path in image_files])
+        return []
+
+    changed = reconcile_annotation_store(store, image_files, results_path)
+    if changed:
+        print(f"Re-examined class folders: {changed}")
+    return changed
+
+
+def create_annotation_store(image_files, results_path):
+    store = open_annotation_store()
+    sync_annotation_store(store, image_files, results_path)
+    return store
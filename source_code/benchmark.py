@@ -0,0 +1,388 @@
+import os
+import sys
+import json
+import time
+import zlib
+import struct
+import shutil
+import random
+import argparse
+import platform
+import datetime
+import subprocess
+import numpy as np
+
+# Synthetic image_path trees and timings of the annotation hot paths:
+#   python benchmark.py generate DIR --slides 10 --patches 100
+#   python benchmark.py run --sizes 1000,100000,1000000 --output benchmark.json
+#   python benchmark.py imports --budget-ms 500   # import-time breakdown of main.py
+
+CLASS_FOLDERS = {"1_tumor": 0.05, "2_stroma": 0.02}
+# 대화형 경로에서 불러오면 안 되는 무거운 모듈 (내보내기/스냅샷에서만 사용)
+LAZY_MODULES = ["pandas"]
+
+
+def png_bytes(pixels):
+    height, width, _ = pixels.shape
+    raw = b"".join(b"\x00" + row.tobytes() for row in pixels)
+
+    def chunk(tag, data):
+        return (
+            struct.pack(">I", len(data))
+            + tag
+            + data
+            + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+        )
+
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(raw, 1))
+        + chunk(b"IEND", b"")
+    )
+
+
+def link_or_copy(source, target):
+    # 하드링크를 못 만드는 파일시스템(FAT/exFAT, 일부 네트워크 공유)은 복사
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+def generate_dataset(root, slides, patches, image_size=64, magnification="20X", seed=0):
+    # PNG 인코딩 비용을 줄이려고 몇 가지 이미지를 돌려 씀
+    rng = np.random.default_rng(seed)
+    scores = random.Random(seed)
+    blobs = [
+        png_bytes(rng.integers(0, 256, (image_size, image_size, 3), dtype=np.uint8))
+        for _ in range(16)
+    ]
+    stride = image_size * 2
+    columns = max(1, int(patches**0.5))
+
+    results_path = os.path.join(root, "Classification_Results")
+    for folder in CLASS_FOLDERS:
+        os.makedirs(os.path.join(results_path, folder), exist_ok=True)
+    os.makedirs(os.path.join(root, "Intermin_Saved"), exist_ok=True)
+
+    for slide in range(1, slides + 1):
+        slide_name = f"Slide_{slide:03d}"
+        patch_dir = os.path.join(root, "image_path", slide_name, magnification)
+        os.makedirs(patch_dir, exist_ok=True)
+        for rank in range(1, patches + 1):
+            x = 20000 + (rank % columns) * stride
+            y = 170000 + (rank // columns) * stride
+            file_name = f"{slide_name}_top-{rank}_x_{x}_y_{y}_{scores.random()}.png"
+            patch_path = os.path.join(patch_dir, file_name)
+            with open(patch_path, "wb") as f:
+                f.write(blobs[rank % len(blobs)])
+
+            for folder, fraction in CLASS_FOLDERS.items():
+                if scores.random() < fraction:
+                    link_or_copy(
+                        patch_path, os.path.join(results_path, folder, file_name)
+                    )
+
+
+def timing(durations):
+    return {
+        "count": len(durations),
+        "mean_s": sum(durations) / len(durations),
+        "min_s": min(durations),
+        "max_s": max(durations),
+    }
+
+
+def timed(results, name, func, *args, repeat=1):
+    durations = []
+    value = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        value = func(*args)
+        durations.append(time.perf_counter() - started)
+    results[name] = timing(durations)
+    return value
+
+
+def measure(root, gui=True, repeat=20):
+    # 새 프로세스에서 실행되어 캐시/import 상태가 크기별로 섞이지 않음
+    os.environ.update(
+        {
+            "PATCH_FOLDER": os.path.join(root, "image_path"),
+            "RESULT_FOLDER": os.path.join(root, "Classification_Results"),
+            "INTERMIN_SAVED": os.path.join(root, "Intermin_Saved"),
+            "DATABASE": os.path.join(root, "DB.csv"),
+            "MANIFEST": os.path.join(root, "patch_manifest.json"),
+            "ANNOTATION_DB": os.path.join(root, "annotations.sqlite3"),
+            "THUMBNAIL_FOLDER": os.path.join(root, "Thumbnails"),
+            "PYRAMID_FOLDER": os.path.join(root, "Pyramid"),
+        }
+    )
+    # 이전 측정이 남긴 저장소 파일을 지워 매번 클래스 폴더에서 새로 시작
+    for stale in [
+        "patch_manifest.json",
+        "annotations.sqlite3",
+        "annotations.sqlite3-wal",
+        "annotations.sqlite3-shm",
+        "DB.csv",
+        "DB.csv.journal",
+        "DB.csv.journal.compacting",
+        "DB.csv.folders.json",
+    ]:
+        if os.path.exists(os.path.join(root, stale)):
+            os.remove(os.path.join(root, stale))
+
+    from functions import (
+        configure_environment,
+        get_sorted_files,
+        create_classification_csv,
+        list_class_folders,
+    )
+    from annotation_store import create_annotation_store
+    from snapshots import save_classification_state
+
+    configure_environment()
+    images_path = os.environ["PATCH_FOLDER"]
+    results_path = os.environ["RESULT_FOLDER"]
+    results = {}
+
+    image_files = timed(results, "get_sorted_files_cold", get_sorted_files, images_path)
+    timed(results, "get_sorted_files_warm", get_sorted_files, images_path)
+    timed(
+        results,
+        "create_classification_csv",
+        create_classification_csv,
+        image_files,
+        results_path,
+    )
+    store = timed(
+        results,
+        "create_annotation_store_cold",
+        create_annotation_store,
+        image_files,
+        results_path,
+    )
+    store.close()
+    store = timed(
+        results,
+        "create_annotation_store_warm",
+        create_annotation_store,
+        image_files,
+        results_path,
+    )
+    labels = {name: class_ids for name, class_ids in store.items() if class_ids}
+    store.close()
+    timed(
+        results,
+        "save_classification_state",
+        save_classification_state,
+        labels,
+        list_class_folders(results_path),
+        os.environ["INTERMIN_SAVED"],
+    )
+
+    if gui:
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+        from PyQt5.QtWidgets import QApplication
+
+        app = QApplication(sys.argv[:1])
+        from ui_manager import MainUI
+
+        def startup():
+            ui = MainUI()
+            ui.show()
+            app.processEvents()
+            return ui
+
+        def wait_for(condition):
+            while not condition():
+                app.processEvents()
+                time.sleep(0.001)
+
+        started = time.perf_counter()
+        ui = timed(results, "main_ui_startup", startup)
+        # 패치 목록은 창이 뜬 뒤 스트리밍되므로 첫 패치와 전체 로딩을 따로 측정
+        wait_for(lambda: len(ui.patch_table) > 0)
+        results["main_ui_first_patch"] = timing([time.perf_counter() - started])
+        wait_for(lambda: ui.patch_loader.done)
+        ui.classification_manager.write_queue.flush()  # class-folder reconcile
+        app.processEvents()
+        results["main_ui_patch_list"] = timing([time.perf_counter() - started])
+        viewer, manager = ui.image_viewer, ui.classification_manager
+
+        def navigate():
+            viewer.show_next_image()
+            app.processEvents()
+
+        timed(results, "navigation_next", navigate, repeat=repeat)
+
+        def select():
+            manager.select_buttons[0].click()
+            app.processEvents()
+
+        timed(results, "handle_select_button_click", select, repeat=repeat)
+        timed(results, "write_queue_flush", manager.write_queue.flush)
+        if repeat % 2:
+            # 선택은 토글이므로 한 번 더 눌러 생성된 라벨/클래스 폴더로 되돌림
+            select()
+            manager.write_queue.flush()
+        timed(
+            results,
+            "update_text_input_states",
+            manager.update_text_input_states,
+            repeat=repeat,
+        )
+        ui.close()
+
+    return {"patches": len(image_files), "timings": results}
+
+
+def import_report(module="main", top=15):
+    # python -X importtime: "import time: self [us] | cumulative | name"
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        check=True,
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env={**os.environ, "QT_QPA_PLATFORM": "offscreen"},
+    ).stderr
+
+    entries = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        entries.append((name.rstrip(), int(self_us), int(cumulative_us)))
+
+    # module의 하위 import는 바로 앞의 최상위 항목 다음부터 module 줄까지
+    end = max(
+        position for position, entry in enumerate(entries) if entry[0] == f" {module}"
+    )
+    start = end
+    while start > 0 and entries[start - 1][0].startswith("   "):
+        start -= 1
+
+    packages = {}
+    for name, self_us, _ in entries[start : end + 1]:
+        package = name.strip().split(".")[0]
+        packages[package] = packages.get(package, 0) + self_us
+    loaded = {name.strip() for name, _, _ in entries[start : end + 1]}
+    return {
+        "module": module,
+        "total_ms": entries[end][2] / 1000,
+        "packages_ms": {
+            package: self_us / 1000
+            for package, self_us in sorted(
+                packages.items(), key=lambda item: item[1], reverse=True
+            )[:top]
+        },
+        "lazy_modules_loaded": [name for name in LAZY_MODULES if name in loaded],
+    }
+
+
+def command_imports(args):
+    report = import_report(args.module)
+    print(json.dumps(report, indent=2))
+    over_budget = report["total_ms"] > args.budget_ms
+    if over_budget:
+        print(f"Import time {report['total_ms']:.1f} ms exceeds {args.budget_ms} ms")
+    if report["lazy_modules_loaded"]:
+        print(f"Loaded at startup: {report['lazy_modules_loaded']}")
+    if over_budget or report["lazy_modules_loaded"]:
+        sys.exit(1)
+
+
+def command_generate(args):
+    generate_dataset(
+        args.root, args.slides, args.patches, args.image_size, seed=args.seed
+    )
+    print(f"Generated {args.slides * args.patches} patches in {args.root}")
+
+
+def command_measure(args):
+    print(json.dumps(measure(args.root, not args.skip_gui, args.repeat)))
+
+
+def command_run(args):
+    report = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "image_size": args.image_size,
+        "imports": import_report(),
+        "results": [],
+    }
+    for size in [int(size) for size in args.sizes.split(",")]:
+        slides = max(1, min(args.max_slides, size // args.patches_per_slide))
+        patches = size // slides
+        root = os.path.join(args.workdir, f"patches_{size}")
+        if not os.path.isdir(root):
+            print(f"Generating {slides} x {patches} patches in {root}")
+            generate_dataset(root, slides, patches, args.image_size, seed=args.seed)
+
+        command = [sys.executable, os.path.abspath(__file__), "measure", root]
+        command += ["--repeat", str(args.repeat)]
+        if args.skip_gui:
+            command.append("--skip-gui")
+        output = subprocess.run(
+            command, check=True, capture_output=True, text=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        report["results"].append(result)
+        print(json.dumps(result, indent=2))
+
+        if args.cleanup:
+            shutil.rmtree(root)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Benchmark results written to: {args.output}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="PathoPatch benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    generate = subparsers.add_parser("generate", help="write a synthetic image_path")
+    generate.add_argument("root")
+    generate.add_argument("--slides", type=int, default=10)
+    generate.add_argument("--patches", type=int, default=100, help="per slide")
+    generate.add_argument("--image-size", type=int, default=64)
+    generate.add_argument("--seed", type=int, default=0)
+    generate.set_defaults(func=command_generate)
+
+    measure_parser = subparsers.add_parser("measure", help="time one generated tree")
+    measure_parser.add_argument("root")
+    measure_parser.add_argument("--repeat", type=int, default=20)
+    measure_parser.add_argument("--skip-gui", action="store_true")
+    measure_parser.set_defaults(func=command_measure)
+
+    imports = subparsers.add_parser(
+        "imports", help="import-time breakdown, fails over the budget"
+    )
+    imports.add_argument("--module", default="main")
+    imports.add_argument("--budget-ms", type=float, default=500)
+    imports.set_defaults(func=command_imports)
+
+    run = subparsers.add_parser("run", help="generate, time and write JSON")
+    run.add_argument("--sizes", default="1000,100000,1000000")
+    run.add_argument("--workdir", default=os.path.join("..", "benchmark_data"))
+    run.add_argument("--output", default="benchmark_results.json")
+    run.add_argument("--patches-per-slide", type=int, default=1000)
+    run.add_argument("--max-slides", type=int, default=1000)
+    run.add_argument("--image-size", type=int, default=64)
+    run.add_argument("--repeat", type=int, default=20)
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--skip-gui", action="store_true")
+    run.add_argument(
+        "--cleanup", action="store_true", help="delete each tree after timing it"
+    )
+    run.set_defaults(func=command_run)
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    args.func(args)
@@ -0,0 +1,76 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, CancelledError, as_completed
+from functions import materialize_patch
+
+
+class BulkLabelJob:
+    # Adds or removes one class for many patches: parallel file work, one commit
+    def __init__(
+        self, class_id, add, file_names, source_paths, target_paths, on_progress=None
+    ):
+        self.class_id = class_id
+        self.add = add
+        self.file_names = file_names
+        self.source_paths = source_paths
+        self.target_paths = target_paths
+        self.on_progress = on_progress
+        self.applied = []
+        self.failed = 0
+        self.cancelled = threading.Event()
+
+    def __len__(self):
+        return len(self.file_names)
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def apply_file(self, position, mode):
+        if self.cancelled.is_set():
+            raise CancelledError()
+        target_path = self.target_paths[position]
+        if self.add:
+            materialize_patch(self.source_paths[position], target_path, mode)
+        elif os.path.lexists(target_path):
+            os.remove(target_path)
+
+    def run(self, annotation_store, mode, workers=8):
+        if self.add and self.target_paths:
+            os.makedirs(os.path.dirname(self.target_paths[0]), exist_ok=True)
+
+        applied = []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(self.apply_file, position, mode): position
+                for position in range(len(self))
+            }
+            for future in as_completed(futures):
+                if self.cancelled.is_set():
+                    # 아직 시작하지 않은 파일 작업은 건너뜀
+                    for pending in futures:
+                        pending.cancel()
+                try:
+                    future.result()
+                    applied.append(futures[future])
+                except CancelledError:
+                    continue
+                except Exception as e:
+                    self.failed += 1
+                    print(
+                        f"Bulk label failed for {self.target_paths[futures[future]]}: {e}"
+                    )
+                if self.on_progress is not None:
+                    self.on_progress(len(applied), len(self))
+
+        # 실제로 반영된 파일만 한 번의 트랜잭션으로 기록
+        applied.sort()
+        with annotation_store.batch():
+            for position in applied:
+                if self.add:
+                    annotation_store.add_label(self.file_names[position], self.class_id)
+                else:
+                    annotation_store.remove_label(
+                        self.file_names[position], self.class_id
+                    )
+        self.applied = [self.file_names[position] for position in applied]
+        return self.applied
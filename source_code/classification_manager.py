@@ -1,11 +1,10 @@
 import os
 import sys
-import datetime
 import shutil
-import pandas as pd
-import numpy as np
+import threading
 from PyQt5.QtWidgets import (
     QWidget,
+    QLabel,
     QScrollArea,
     QVBoxLayout,
     QHBoxLayout,
@@ -13,13 +12,37 @@ from PyQt5.QtWidgets import (
     QPushButton,
     QSizePolicy,
     QFileDialog,
+    QProgressDialog,
 )
-from PyQt5.QtCore import Qt, pyqtSignal
-from functions import resource_path
+from PyQt5.QtCore import Qt, pyqtSignal, QTimer
+from functions import (
+    resource_path,
+    scan_result_labels,
+    materialize_patch,
+    list_class_folders,
+)
+from annotation_store import export_class_folders
+from snapshots import SnapshotWriter
+from write_queue import WriteBehindQueue
+from bulk_labels import BulkLabelJob
+from instrumentation import timed
 
 
 class ClassificationManager(QWidget):
-    def __init__(self, result_folder, itermin_saved, get_current_image_path):
+    labels_rescanned = pyqtSignal(object, object, int)
+    write_status_changed = pyqtSignal(int, int)
+    bulk_progress = pyqtSignal(int, int)
+    bulk_finished = pyqtSignal(object)
+
+    def __init__(
+        self,
+        result_folder,
+        itermin_saved,
+        get_current_image_path,
+        annotation_store,
+        label_index,
+        get_selected_image_paths=None,
+    ):
         super().__init__()
 
         with open(
@@ -30,14 +53,50 @@ class ClassificationManager(QWidget):
         self.result_folder = result_folder
         self.itermin_saved = itermin_saved
         self.get_current_image_path = get_current_image_path
+        self.get_selected_image_paths = get_selected_image_paths
+        self.annotation_store = annotation_store
+        self.label_index = label_index
+        self.materialization_mode = os.environ["MATERIALIZATION_MODE"]
         self.text_inputs = []
         self.select_buttons = []
         self.input_containers = []
         self.default_text_width = 300
         self.default_text_height = 40
         self.default_spacing = 10
+
+        # 파일/DB 변경은 백그라운드에서 순서대로 반영하고 UI는 먼저 갱신
+        self.write_status_changed.connect(self.update_write_status)
+        self.write_queue = WriteBehindQueue(self.write_status_changed.emit)
+        self.resync_requested = False  # 쓰기가 끝나면 폴더와 다시 비교할지
+        self.bulk_workers = int(os.environ["BULK_WORKERS"])
+        self.bulk_dialog = None
+        self.bulk_progress.connect(self.update_bulk_progress)
+        self.bulk_finished.connect(self.finish_bulk_labels)
         self.setup_ui()
 
+        # Optional periodic re-sync of the label index against Classification_Results
+        self.resync_thread = None
+        self.labels_rescanned.connect(self.apply_rescanned_labels)
+        self.resync_timer = QTimer(self)
+        self.resync_timer.timeout.connect(self.start_label_resync)
+        resync_seconds = float(os.environ["LABEL_RESYNC_SECONDS"])
+        if resync_seconds > 0 and self.materialization_mode != "virtual":
+            self.resync_timer.start(int(resync_seconds * 1000))
+
+        # Interim snapshots are built from the label index on their own thread
+        self.snapshot_writer = SnapshotWriter(
+            itermin_saved,
+            os.environ["SNAPSHOT_MODE"],
+            os.environ["SNAPSHOT_COMPRESSION"],
+        )
+        self.snapshot_thread = None
+        self.snapshot_version = None
+        self.snapshot_timer = QTimer(self)
+        self.snapshot_timer.timeout.connect(self.auto_snapshot)
+        snapshot_minutes = float(os.environ["AUTO_SNAPSHOT_MINUTES"])
+        if snapshot_minutes > 0:
+            self.snapshot_timer.start(int(snapshot_minutes * 60 * 1000))
+
     def setup_ui(self):
         self.merge_duplicate_folders(self.result_folder)
         main_layout = QVBoxLayout()
@@ -90,6 +149,20 @@ class ClassificationManager(QWidget):
         self.save_button.clicked.connect(self.save_classification_state)
         main_layout.addWidget(self.save_button)
 
+        self.export_button = QPushButton("Export Database CSV")
+        self.export_button.clicked.connect(self.export_database_csv)
+        main_layout.addWidget(self.export_button)
+
+        # 가상 모드에서는 내보내기 전까지 결과 폴더에 이미지를 쓰지 않음
+        self.export_folders_button = QPushButton("Export Class Folders")
+        self.export_folders_button.clicked.connect(self.export_class_folders)
+        self.export_folders_button.setVisible(self.materialization_mode == "virtual")
+        main_layout.addWidget(self.export_folders_button)
+
+        self.write_status_label = QLabel()
+        main_layout.addWidget(self.write_status_label)
+        self.update_write_status(0, 0)
+
         self.setLayout(main_layout)
 
         self.update_text_input_states()
@@ -146,85 +219,156 @@ class ClassificationManager(QWidget):
         self.update_text_input_states()
         self.update_delete_buttons()
 
+    @timed("classification_manager.handle_select_button_click")
     def handle_select_button_click(self, index, button):
+        if self.get_selected_image_paths is not None:
+            selected_paths = self.get_selected_image_paths()
+            if len(selected_paths) > 1:
+                self.apply_bulk_labels(index, selected_paths)
+                return
+
         is_active = button.property("is_active")
         selected_folder = f"{index + 1}_{self.text_inputs[index].toPlainText().strip()}"
         selected_folder_path = os.path.join(self.result_folder, selected_folder)
         current_image_path = self.get_current_image_path()
+        if current_image_path is None:
+            return
         image_name = os.path.basename(current_image_path)
         target_image_path = os.path.join(selected_folder_path, image_name)
 
-        csv_path = os.environ["DATABASE"]
-        df = pd.read_csv(csv_path, dtype={"classification": str})
+        class_id = index + 1  # 결과 폴더의 번호 접두사와 동일
 
         if not is_active:
             button.setProperty("is_active", True)
-            os.makedirs(selected_folder_path, exist_ok=True)
-            shutil.copy(current_image_path, target_image_path)
-
-            df["classification"] = df["classification"].fillna("").astype(str)
-            current_classification = df.loc[
-                df["file_name"] == image_name, "classification"
-            ].values
-            if len(current_classification) == 0 or pd.isna(current_classification[0]):
-                updated_classification = str(index)  # NaN이나 비어 있으면 index로 설정
-            else:
-                # 쉼표로 분리된 값 리스트 생성
-                existing_values = [
-                    value.strip()
-                    for value in str(current_classification[0]).split(",")
-                    if value.strip()
-                ]
-                if str(index) not in existing_values:
-                    existing_values.append(str(index))  # index 추가
-                updated_classification = ",".join(existing_values)
-
-            df.loc[df["file_name"] == image_name, "classification"] = (
-                updated_classification
+            self.label_index.add(image_name, class_id)
+            self.write_queue.submit(
+                f"select {target_image_path}",
+                self.write_selection,
+                current_image_path,
+                target_image_path,
+                image_name,
+                class_id,
             )
-            df.to_csv(csv_path, index=False)
-            self.update_text_input_states()
 
         else:
             button.setProperty("is_active", False)
-            if os.path.exists(target_image_path):
-                try:
-                    os.remove(target_image_path)
-                    print(f"Deleted {target_image_path}")
-                except Exception as e:
-                    print(f"Error deleting file: {e}")
-
-            df["classification"] = df["classification"].fillna("").astype(str)
-            current_classification = df.loc[
-                df["file_name"] == image_name, "classification"
-            ].values
-            if len(current_classification) > 0 and not pd.isna(
-                current_classification[0]
-            ):
-                # 쉼표로 분리된 값 리스트 생성
-                existing_values = [
-                    value.strip()
-                    for value in str(current_classification[0]).split(",")
-                    if value.strip()
-                ]
-                updated_values = [
-                    value for value in existing_values if value != str(index)
-                ]  # index 제거
-                updated_classification = (
-                    ",".join(updated_values) if updated_values else np.nan
-                )
+            self.label_index.remove(image_name, class_id)
+            self.write_queue.submit(
+                f"deselect {target_image_path}",
+                self.write_deselection,
+                target_image_path,
+                image_name,
+                class_id,
+            )
 
-                df.loc[df["file_name"] == image_name, "classification"] = (
-                    updated_classification
-                )
+        self.update_text_input_states()
 
-            df.to_csv(csv_path, index=False)
+    def write_selection(self, source_path, target_path, image_name, class_id):
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        materialize_patch(source_path, target_path, self.materialization_mode)
+        self.annotation_store.add_label(image_name, class_id)
 
-            self.update_text_input_states()
-            pass
+    def write_deselection(self, target_path, image_name, class_id):
+        if os.path.lexists(target_path):
+            try:
+                os.remove(target_path)
+                print(f"Deleted {target_path}")
+            except Exception as e:
+                print(f"Error deleting file: {e}")
+        self.annotation_store.remove_label(image_name, class_id)
+
+    def apply_bulk_labels(self, index, image_paths):
+        class_id = index + 1
+        selected_folder_path = os.path.join(
+            self.result_folder,
+            f"{index + 1}_{self.text_inputs[index].toPlainText().strip()}",
+        )
+        image_names = [os.path.basename(path) for path in image_paths]
+        # 선택한 패치가 모두 이 클래스면 해제, 아니면 빠진 패치에만 추가
+        add = not all(
+            class_id in self.label_index.classes_of(name) for name in image_names
+        )
+        changed = [
+            (path, name)
+            for path, name in zip(image_paths, image_names)
+            if (class_id in self.label_index.classes_of(name)) != add
+        ]
+
+        job = BulkLabelJob(
+            class_id,
+            add,
+            [name for _, name in changed],
+            [path for path, _ in changed],
+            [os.path.join(selected_folder_path, name) for _, name in changed],
+            self.bulk_progress.emit,
+        )
+        for name in job.file_names:
+            if add:
+                self.label_index.add(name, class_id)
+            else:
+                self.label_index.remove(name, class_id)
+        self.update_text_input_states()
+
+        self.bulk_dialog = QProgressDialog(
+            f"{'Adding' if add else 'Removing'} class {class_id} "
+            f"for {len(job)} patches...",
+            "Cancel",
+            0,
+            len(job),
+            self,
+        )
+        self.bulk_dialog.setWindowModality(Qt.WindowModal)
+        self.bulk_dialog.setMinimumDuration(300)
+        self.bulk_dialog.canceled.connect(job.cancel)
+        self.write_queue.submit(
+            f"bulk class {class_id} ({len(job)} patches)", self.write_bulk_labels, job
+        )
+
+    def write_bulk_labels(self, job):
+        try:
+            job.run(self.annotation_store, self.materialization_mode, self.bulk_workers)
+        finally:
+            self.bulk_finished.emit(job)
+
+    def update_bulk_progress(self, done, total):
+        if self.bulk_dialog is not None:
+            self.bulk_dialog.setValue(done)
+
+    def finish_bulk_labels(self, job):
+        # 취소되거나 실패한 패치는 화면 상태를 되돌림
+        applied = set(job.applied)
+        for name in job.file_names:
+            if name in applied:
+                continue
+            if job.add:
+                self.label_index.remove(name, job.class_id)
+            else:
+                self.label_index.add(name, job.class_id)
+        if self.bulk_dialog is not None:
+            self.bulk_dialog.reset()
+            self.bulk_dialog = None
+        print(
+            f"{'Added' if job.add else 'Removed'} class {job.class_id} for "
+            f"{len(applied)}/{len(job)} patches"
+        )
+        self.update_text_input_states()
+
+    def update_write_status(self, pending, failed):
+        if pending:
+            text = f"Saving {pending} change(s)..."
+        else:
+            text = "All changes saved"
+        if failed:
+            text += f" ({failed} failed, see console)"
+        self.write_status_label.setText(text)
+        if not pending and self.resync_requested:
+            # 쓰기가 밀려 미뤄진 재동기화를 큐가 비었을 때 실행
+            self.start_label_resync()
 
     def on_text_finalized(self, index, text):
-        self.create_or_update_folder(index, text)
+        self.write_queue.submit(
+            f"rename class {index}", self.create_or_update_folder, index, text
+        )
 
     def on_text_changed(self):
         enable_next = True
@@ -261,29 +405,18 @@ class ClassificationManager(QWidget):
         elif not os.path.exists(new_folder_path) and folder_name:
             os.makedirs(new_folder_path)
 
+    @timed("classification_manager.update_text_input_states")
     def update_text_input_states(self):
         enable_next = True
         current_image_path = self.get_current_image_path()
-        current_image_name = os.path.basename(current_image_path)
+        # 첫 슬라이드가 로딩되기 전에는 현재 패치가 없음
+        current_image_name = os.path.basename(current_image_path or "")
+        class_ids = self.label_index.classes_of(current_image_name)
 
         for i, text_input in enumerate(self.text_inputs):
             select_button = self.select_buttons[i]
-            folder_name = text_input.toPlainText().strip()
-            folder_path = os.path.join(self.result_folder, f"{i + 1}_{folder_name}")
 
-            is_currently_green = (
-                "background-color: lightgreen;" in text_input.styleSheet()
-            )
-            is_green = False
-
-            if os.path.isdir(folder_path):
-                for file_name in os.listdir(folder_path):
-                    file_path = os.path.join(folder_path, file_name)
-                    if os.path.isfile(file_path) and current_image_name == file_name:
-                        is_green = True
-                        break
-
-            if is_green:
+            if i + 1 in class_ids:
                 text_input.setStyleSheet("background-color: lightgreen;")
                 select_button.setProperty("is_active", True)
             else:
@@ -302,6 +435,67 @@ class ClassificationManager(QWidget):
             if not text_input.isEnabled():
                 enable_next = False
 
+    def request_label_resync(self):
+        # 주기적 재동기화가 꺼져 있어도 한 번은 반드시 폴더와 비교
+        if self.materialization_mode == "virtual":
+            return
+        self.resync_requested = True
+        self.start_label_resync()
+
+    def start_label_resync(self):
+        if self.resync_thread is not None and self.resync_thread.is_alive():
+            return
+        # 대기 중인 쓰기가 있으면 파일시스템이 아직 최신이 아님
+        if self.write_queue.pending():
+            return
+
+        snapshot, version = self.label_index.snapshot()
+
+        def rescan():
+            labels = scan_result_labels(self.result_folder)
+            added = [
+                (file_name, class_id)
+                for file_name, class_ids in labels.items()
+                for class_id in class_ids - snapshot.get(file_name, set())
+            ]
+            removed = [
+                (file_name, class_id)
+                for file_name, class_ids in snapshot.items()
+                for class_id in class_ids - labels.get(file_name, set())
+            ]
+            self.labels_rescanned.emit(added, removed, version)
+
+        self.resync_thread = threading.Thread(target=rescan, daemon=True)
+        self.resync_thread.start()
+
+    def apply_rescanned_labels(self, added, removed, version):
+        self.resync_thread = None
+        # 스캔 도중 라벨이 바뀌었다면 다음 주기에 (요청된 경우 바로) 다시 비교
+        if version != self.label_index.version:
+            if self.resync_requested:
+                self.start_label_resync()
+            return
+        self.resync_requested = False
+        if not (added or removed):
+            return
+
+        for file_name, class_id in added:
+            self.label_index.add(file_name, class_id)
+        for file_name, class_id in removed:
+            self.label_index.remove(file_name, class_id)
+        self.write_queue.submit(
+            "apply label re-sync", self.write_rescanned_labels, added, removed
+        )
+        print(f"Label index re-synced: +{len(added)} / -{len(removed)}")
+        self.update_text_input_states()
+
+    def write_rescanned_labels(self, added, removed):
+        with self.annotation_store.batch():
+            for file_name, class_id in added:
+                self.annotation_store.add_label(file_name, class_id)
+            for file_name, class_id in removed:
+                self.annotation_store.remove_label(file_name, class_id)
+
     def update_delete_buttons(self):
         if len(self.text_inputs) <= 4:
             for container in self.input_containers:
@@ -326,8 +520,13 @@ class ClassificationManager(QWidget):
             current_folder = f"{index + 1}_{text_input.toPlainText().strip()}"
             current_folder_path = os.path.join(self.result_folder, current_folder)
 
-            if os.path.exists(current_folder_path):
-                shutil.rmtree(current_folder_path)
+            self.label_index.remove_class(index + 1)
+            self.write_queue.submit(
+                f"remove class {index + 1}",
+                self.write_class_removal,
+                current_folder_path,
+                index + 1,
+            )
 
             self.text_inputs.remove(text_input)
             self.select_buttons.pop(index)
@@ -339,6 +538,11 @@ class ClassificationManager(QWidget):
             self.update_text_input_states()
             self.update_delete_buttons()
 
+    def write_class_removal(self, folder_path, class_id):
+        if os.path.exists(folder_path):
+            shutil.rmtree(folder_path)
+        self.annotation_store.remove_class(class_id)
+
     def initialize_csv(self):
         # 파일 다이얼로그로 CSV 파일을 선택
         file_path, _ = QFileDialog.getOpenFileName(
@@ -346,7 +550,11 @@ class ClassificationManager(QWidget):
         )
 
         if file_path:
+            # 폴더 이름을 바꾸기 전에 대기 중인 변경을 모두 반영
+            self.write_queue.flush()
             try:
+                import pandas as pd
+
                 df = pd.read_csv(file_path, encoding="cp949")
                 result_folder = os.environ["RESULT_FOLDER"]
                 if not os.path.exists(result_folder):
@@ -464,41 +672,56 @@ class ClassificationManager(QWidget):
         self.update_delete_buttons()
 
     def save_classification_state(self):
-        # Classification_Results 폴더 훑기
-        classification_data = {}
-        folders = [
-            folder
-            for folder in os.listdir(self.result_folder)
-            if folder.split("_")[0].isdigit()
-        ]
-        folders.sort(key=lambda x: int(x.split("_")[0]))  # 숫자 순서로 정렬
-
-        for folder in folders:
-            folder_path = os.path.join(self.result_folder, folder)
-            if os.path.isdir(folder_path):
-                for file_name in os.listdir(folder_path):
-                    if file_name not in classification_data:
-                        classification_data[file_name] = []
-                    classification_data[file_name].append(
-                        folder.split("_")[0]
-                    )  # 폴더 번호 추가
-
-        # 데이터프레임 생성
-        unique_classifications = sorted({f.split("_")[0] for f in folders}, key=int)
-        df = pd.DataFrame(
-            index=classification_data.keys(), columns=unique_classifications
+        if self.snapshot_thread is not None and self.snapshot_thread.is_alive():
+            print("An interim snapshot is already being written")
+            return
+
+        def write_snapshot():
+            labels, version = self.label_index.snapshot()
+            try:
+                self.snapshot_writer.write(
+                    labels, list_class_folders(self.result_folder)
+                )
+                self.snapshot_version = version
+            except Exception as e:
+                print(f"Interim save failed: {e}")
+
+        self.snapshot_thread = threading.Thread(
+            target=write_snapshot, name="interim-snapshot", daemon=True
         )
-        df = df.fillna("")
+        self.snapshot_thread.start()
 
-        for file_name, classifications in classification_data.items():
-            for classification in classifications:
-                df.loc[file_name, classification] = "O"  # 해당 클래스에 체크 표시
+    def auto_snapshot(self):
+        # 마지막 스냅샷 이후 라벨이 바뀌었을 때만 저장
+        if self.label_index.version != self.snapshot_version:
+            self.save_classification_state()
 
-        # 현재 시간 기준으로 파일 저장
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        save_path = os.path.join(self.itermin_saved, f"saved_{timestamp}.csv")
-        df.to_csv(save_path, encoding="utf-8-sig")
-        print(f"Classification state saved to: {save_path}")
+    def export_database_csv(self):
+        self.write_queue.submit("export database", self.write_database_csv)
+
+    def write_database_csv(self):
+        csv_path = os.environ["DATABASE"]
+        self.annotation_store.export_csv(csv_path)
+        print(f"Database exported to: {csv_path}")
+
+    def export_class_folders(self):
+        self.write_queue.submit("export class folders", self.write_class_folders)
+
+    def write_class_folders(self):
+        exported = export_class_folders(
+            self.annotation_store,
+            os.environ["PATCH_FOLDER"],
+            self.result_folder,
+            os.environ["EXPORT_MATERIALIZATION_MODE"],
+        )
+        print(f"Exported {exported} patches to class folders")
+
+    def shutdown(self):
+        self.resync_timer.stop()
+        self.snapshot_timer.stop()
+        if self.snapshot_thread is not None:
+            self.snapshot_thread.join()
+        self.write_queue.close()
 
     def resizeEvent(self, event):
         for text_input in self.text_inputs:
@@ -0,0 +1,297 @@
+import os
+import csv
+import shutil
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from functions import configure_environment, list_class_folders
+from patch_manifest import load_patch_table
+from patch_archive import write_archive, verify_archive
+from annotation_store import (
+    open_annotation_store,
+    create_annotation_store,
+    rebuild_annotation_store,
+    export_class_folders,
+    read_label_file,
+)
+from snapshots import save_classification_state
+from spatial_index import SpatialIndex, patch_wsi_size
+
+# Headless entry point: the same functions the GUI uses, without importing PyQt5
+
+
+def load_image_files(workers):
+    return load_patch_table(
+        os.environ["PATCH_FOLDER"],
+        os.environ["PATCH_MAGNIFICATION"],
+        os.environ["MANIFEST"],
+        workers,
+        ProcessPoolExecutor,
+    )
+
+
+def command_scan(args):
+    patch_table = load_image_files(args.workers)
+    print(f"{len(patch_table)} patches in {len(patch_table.slide_names)} slides")
+
+
+def command_rebuild_db(args):
+    if os.environ["MATERIALIZATION_MODE"] == "virtual":
+        raise SystemExit(
+            "Class folders are not authoritative in virtual mode; nothing to rebuild"
+        )
+    image_files = load_image_files(args.workers).names
+    store = open_annotation_store()
+    rebuild_annotation_store(
+        store,
+        image_files,
+        os.environ["RESULT_FOLDER"],
+        args.workers,
+        ProcessPoolExecutor,
+    )
+    store.close()
+    print(f"Rebuilt annotation database for {len(image_files)} patches")
+
+
+def command_import_labels(args):
+    image_files = load_image_files(args.workers).names
+    known = set(image_files)
+    labels = read_label_file(args.label_file)
+
+    store = create_annotation_store(image_files, os.environ["RESULT_FOLDER"])
+    imported = skipped = 0
+    with store.batch():
+        for file_name, class_ids in labels.items():
+            if file_name not in known:
+                skipped += 1
+                continue
+            for class_id in class_ids:
+                store.add_label(file_name, class_id)
+                imported += 1
+    print(f"Imported {imported} labels ({skipped} unknown patches skipped)")
+
+    if os.environ["MATERIALIZATION_MODE"] != "virtual":
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            exported = export_class_folders(
+                store,
+                os.environ["PATCH_FOLDER"],
+                os.environ["RESULT_FOLDER"],
+                os.environ["MATERIALIZATION_MODE"],
+                executor,
+            )
+        print(f"Materialized {exported} patches into class folders")
+    store.close()
+
+
+def command_export(args):
+    image_files = load_image_files(args.workers).names
+    store = create_annotation_store(image_files, os.environ["RESULT_FOLDER"])
+
+    csv_path = args.csv or os.environ["DATABASE"]
+    store.export_csv(csv_path)
+    print(f"Database exported to: {csv_path}")
+
+    if args.folders:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            exported = export_class_folders(
+                store,
+                os.environ["PATCH_FOLDER"],
+                os.environ["RESULT_FOLDER"],
+                os.environ["EXPORT_MATERIALIZATION_MODE"],
+                executor,
+            )
+        print(f"Exported {exported} patches to class folders")
+    store.close()
+
+
+def command_pyramid(args):
+    # QImage만 사용하므로 디스플레이 없이 동작
+    from pyramid import level_path, build_levels
+
+    patch_table = load_image_files(args.workers)
+    images_path = os.environ["PATCH_FOLDER"]
+    magnification = os.environ["PATCH_MAGNIFICATION"]
+    levels = args.levels or int(os.environ["PYRAMID_LEVELS"])
+
+    sources, targets = [], []
+    for row in range(len(patch_table)):
+        sources.append(patch_table.patch_path(images_path, row))
+        targets.append(
+            [
+                level_path(
+                    os.environ["PYRAMID_FOLDER"],
+                    patch_table.slide_name(row),
+                    magnification,
+                    patch_table.names[row],
+                    level,
+                )
+                for level in range(1, levels + 1)
+            ]
+        )
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        built = sum(executor.map(build_levels, sources, targets, chunksize=64))
+    print(f"Wrote {built} pyramid levels to {os.environ['PYRAMID_FOLDER']}")
+
+
+def command_pack(args):
+    if args.remove and os.environ["MATERIALIZATION_MODE"] == "symlink":
+        # 클래스 폴더의 심볼릭 링크가 지운 PNG를 가리키게 되므로 거부
+        print("Cannot use --remove with MATERIALIZATION_MODE=symlink")
+        return
+
+    images_path = os.environ["PATCH_FOLDER"]
+    patch_dirs = [
+        os.path.join(entry.path, os.environ["PATCH_MAGNIFICATION"])
+        for entry in os.scandir(images_path)
+        if entry.is_dir()
+        and os.path.isdir(os.path.join(entry.path, os.environ["PATCH_MAGNIFICATION"]))
+    ]
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        counts = list(executor.map(write_archive, patch_dirs))
+    print(f"Packed {sum(counts)} patches from {len(patch_dirs)} slides")
+
+    if args.remove:
+        # 아카이브의 모든 패치 내용이 폴더와 같을 때만 원본 PNG를 지움
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            verified = list(executor.map(verify_archive, patch_dirs))
+        kept = 0
+        for patch_dir, matches in zip(patch_dirs, verified):
+            if not matches:
+                print(f"Keeping {patch_dir}: archive does not match the folder")
+                kept += 1
+                continue
+            shutil.rmtree(patch_dir)
+        if kept:
+            print(f"Removed {len(patch_dirs) - kept} of {len(patch_dirs)} folders")
+        else:
+            print("Removed the packed patch folders")
+
+
+def command_interim_snapshot(args):
+    image_files = load_image_files(args.workers).names
+    store = create_annotation_store(image_files, os.environ["RESULT_FOLDER"])
+    labels = {
+        file_name: class_ids for file_name, class_ids in store.items() if class_ids
+    }
+    store.close()
+    save_classification_state(
+        labels,
+        list_class_folders(os.environ["RESULT_FOLDER"]),
+        os.environ["INTERMIN_SAVED"],
+        os.environ["SNAPSHOT_COMPRESSION"],
+    )
+
+
+def command_overlaps(args):
+    patch_table = load_image_files(args.workers)
+    if not len(patch_table):
+        raise SystemExit("No patches found")
+    patch_size = patch_wsi_size(patch_table.patch_path(os.environ["PATCH_FOLDER"], 0))
+    index = SpatialIndex(patch_table, patch_size)
+    rows_a, _, _ = index.overlapping_pairs(args.min_overlap)
+    redundant = index.redundant_rows(args.min_overlap)
+
+    csv_path = args.csv or os.environ["OVERLAP_REPORT"]
+    with open(csv_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["slide", "file_name", "rank", "overlaps_with", "overlap"])
+        for row in sorted(
+            redundant,
+            key=lambda row: (patch_table.slide_name(row), patch_table.ranks[row]),
+        ):
+            kept, overlap = redundant[row]
+            writer.writerow(
+                [
+                    patch_table.slide_name(row),
+                    patch_table.names[row],
+                    int(patch_table.ranks[row]),
+                    patch_table.names[kept],
+                    round(overlap, 4),
+                ]
+            )
+    print(
+        f"{len(rows_a)} patch pairs overlap by more than {args.min_overlap:.0%} "
+        f"(patch size {patch_size}); {len(redundant)} lower-ranked patches "
+        f"can be skipped, listed in {csv_path}"
+    )
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="PathoPatch headless commands (no GUI required)"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 4,
+        help="processes used for scanning and file materialization",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    scan = subparsers.add_parser("scan", help="refresh the patch manifest")
+    scan.set_defaults(func=command_scan)
+
+    rebuild_db = subparsers.add_parser(
+        "rebuild-db", help="rebuild the annotation database from class folders"
+    )
+    rebuild_db.set_defaults(func=command_rebuild_db)
+
+    import_labels = subparsers.add_parser(
+        "import-labels",
+        help="add labels from a database CSV or an Intermin_Saved snapshot",
+    )
+    import_labels.add_argument("label_file")
+    import_labels.set_defaults(func=command_import_labels)
+
+    export = subparsers.add_parser("export", help="export the annotation database")
+    export.add_argument("--csv", help="output path (default: DATABASE)")
+    export.add_argument(
+        "--folders",
+        action="store_true",
+        help="also write stored labels into the class folders",
+    )
+    export.set_defaults(func=command_export)
+
+    pyramid = subparsers.add_parser(
+        "pyramid", help="precompute downsampled levels of every patch"
+    )
+    pyramid.add_argument(
+        "--levels", type=int, help="number of 2x levels (default: PYRAMID_LEVELS)"
+    )
+    pyramid.set_defaults(func=command_pyramid)
+
+    pack = subparsers.add_parser(
+        "pack", help="pack every slide folder into a single .pack archive"
+    )
+    pack.add_argument(
+        "--remove",
+        action="store_true",
+        help="delete the loose PNG folders once their archive is verified",
+    )
+    pack.set_defaults(func=command_pack)
+
+    interim_snapshot = subparsers.add_parser(
+        "interim-snapshot", help="write an Intermin_Saved snapshot"
+    )
+    interim_snapshot.set_defaults(func=command_interim_snapshot)
+
+    overlaps = subparsers.add_parser(
+        "overlaps", help="report duplicate or overlapping top-k patches"
+    )
+    overlaps.add_argument(
+        "--min-overlap",
+        type=float,
+        default=0.5,
+        help="overlapping area / patch area above which a pair is reported",
+    )
+    overlaps.add_argument("--csv", help="output path (default: OVERLAP_REPORT)")
+    overlaps.set_defaults(func=command_overlaps)
+
+    return parser
+
+
+if __name__ == "__main__":
+    configure_environment()
+    args = build_parser().parse_args()
+    args.func(args)
@@ -0,0 +1,69 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5.QtCore import QRect
+from PyQt5.QtGui import QImage, QPainter, QColor, QPen
+from image_cache import ImageCache
+
+
+def build_mosaic(tiles, origin, span, patch_size, tile_cache):
+    # tiles: [(image_path, x, y)] in WSI coordinates, drawn in order (current last)
+    scale = tile_cache.size / patch_size
+    side = int(round(span * scale))
+    mosaic = QImage(side, side, QImage.Format_ARGB32_Premultiplied)
+    mosaic.fill(QColor("lightgray"))
+
+    painter = QPainter(mosaic)
+    target = None
+    for image_path, x, y in tiles:
+        target = QRect(
+            int(round((x - origin[0]) * scale)),
+            int(round((y - origin[1]) * scale)),
+            tile_cache.size,
+            tile_cache.size,
+        )
+        tile = tile_cache.load(image_path)
+        if tile is not None:
+            painter.drawImage(target, tile)
+    if target is not None:
+        # 현재 패치 위치 표시
+        painter.setPen(QPen(QColor("yellow"), 2))
+        painter.drawRect(target.adjusted(1, 1, -1, -1))
+    painter.end()
+    return mosaic
+
+
+class ContextMosaicBuilder:
+    # One mosaic is built at a time; a newer request replaces a queued one
+    def __init__(self, tile_cache, on_built, cache_bytes):
+        self.tile_cache = tile_cache  # ThumbnailCache: downsampled tiles, on disk
+        self.on_built = on_built
+        self.mosaics = ImageCache(cache_bytes)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="context")
+        self._pending = None
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self.mosaics.get(key)
+
+    def request(self, key, tiles, origin, span, patch_size):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.cancel()
+            self._pending = self._executor.submit(
+                self._build, key, tiles, origin, span, patch_size
+            )
+
+    def _build(self, key, tiles, origin, span, patch_size):
+        try:
+            mosaic = build_mosaic(tiles, origin, span, patch_size, self.tile_cache)
+        except Exception as e:
+            print(f"Context mosaic failed for {key}: {e}")
+            return
+        self.mosaics.put(key, mosaic)
+        self.on_built(key, mosaic)
+
+    def shutdown(self):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.cancel()
+        self._executor.shutdown(wait=True)
@@ -1,7 +1,9 @@
 import os
 import sys
-import glob
-import pandas as pd
+import errno
+import shutil
+from patch_manifest import load_patch_table, stream_patch_tables
+from patch_archive import archived_patch
 
 
 def resource_path(relative_path):
@@ -13,30 +15,236 @@ def resource_path(relative_path):
     return os.path.join(base_path, relative_path)
 
 
-def get_sorted_files(folder_path):
-    files = glob.glob(f'{folder_path}/*/{os.environ["PATCH_MAGNIFICATION"]}/*.png')
+def configure_environment():
+    # Variables already set in the shell take precedence over these defaults
+    preset = dict(os.environ)
+
+    # Environment variables
+    os.environ["ICON_PATH"] = resource_path(os.path.join("style", "icon.png"))
+    os.environ["PATCH_FOLDER"] = resource_path(os.path.join("..", "image_path"))
+    os.environ["DATABASE"] = resource_path(
+        os.path.join("..", "DB_warning_overwrite_on_execution.csv")
+    )
+    os.environ["MANIFEST"] = resource_path(os.path.join("..", "patch_manifest.json"))
+    os.environ["SCAN_WORKERS"] = "8"  # Slide folders rescanned in parallel
+    os.environ["ANNOTATION_BACKEND"] = "sqlite"  # "sqlite" or "csv"
+    # csv backend: label changes go to DATABASE.journal and are folded into the CSV
+    os.environ["JOURNAL_COMMIT_MS"] = "50"  # Group-commit fsync interval
+    os.environ["JOURNAL_COMPACT_ENTRIES"] = "5000"
+    os.environ["ANNOTATION_DB"] = resource_path(
+        os.path.join("..", "annotations.sqlite3")
+    )
+    os.environ["RESULT_FOLDER"] = resource_path(
+        os.path.join("..", "Classification_Results")
+    )
+    os.environ["INTERMIN_SAVED"] = resource_path(os.path.join("..", "Intermin_Saved"))
+    os.environ["MAGNIFICATION_RATIO"] = "2"
+    # Patch side length in WSI coordinates; "" = patch width x MAGNIFICATION_RATIO
+    os.environ["PATCH_WSI_SIZE"] = ""
+    os.environ["OVERLAP_REPORT"] = resource_path(
+        os.path.join("..", "overlap_report.csv")
+    )
+    os.environ["PATCH_MAGNIFICATION"] = (
+        "20X"  # The magnification level of the saved patch
+    )
+    os.environ["DEFAULT_MAGNIFICATION"] = (
+        "20X"  # The magnification level of the default displayed patch
+    )
 
-    files.sort(
-        key=lambda f: (
-            int(os.path.basename(f).split("_")[1]),
-            int(os.path.basename(f).split("_")[2][3:]),
-        )
+    os.environ["PREFETCH_WINDOW"] = "4"  # Patches decoded ahead/behind the current one
+    os.environ["PREFETCH_WORKERS"] = "2"
+    os.environ["IMAGE_CACHE_MB"] = "256"  # Memory budget of the decoded patch cache
+    os.environ["RENDER_CACHE_MB"] = "64"  # Memory budget of the scaled view cache
+    # Downsampled copies of each patch (cli.py pyramid), read for 5X/10X views
+    os.environ["PYRAMID_FOLDER"] = resource_path(os.path.join("..", "Pyramid"))
+    os.environ["PYRAMID_LEVELS"] = "3"
+    os.environ["REGION_DECODING"] = "1"  # Decode only the visible crop on a cache miss
+    # Grid view thumbnails, cached on disk by patch path and mtime
+    os.environ["THUMBNAIL_FOLDER"] = resource_path(os.path.join("..", "Thumbnails"))
+    os.environ["THUMBNAIL_SIZE"] = "128"
+    os.environ["THUMBNAIL_WORKERS"] = "4"
+    os.environ["THUMBNAIL_CACHE_MB"] = "64"
+    # Context panel: neighbouring patches within CONTEXT_RADIUS patch widths
+    os.environ["CONTEXT_RADIUS"] = "1"
+    os.environ["CONTEXT_TILE_SIZE"] = "128"  # Same as THUMBNAIL_SIZE shares its cache
+    os.environ["CONTEXT_CACHE_MB"] = "32"
+    os.environ["LABEL_RESYNC_SECONDS"] = "0"  # Re-check Classification_Results, 0 = off
+    # Ctrl+Shift+Up/Down jump to the next patch above/below this prediction score
+    os.environ["JUMP_SCORE_THRESHOLD"] = "0.5"
+    # How a selected patch appears in its class folder:
+    # "copy", "hardlink", "symlink", "reflink" or "virtual" (only written on export)
+    os.environ["MATERIALIZATION_MODE"] = "hardlink"
+    os.environ["EXPORT_MATERIALIZATION_MODE"] = "hardlink"
+    os.environ["BULK_WORKERS"] = "8"  # Parallel file writes for multi-patch labelling
+    # Intermin_Saved: "full" or "differential" (changes since the previous save),
+    # SNAPSHOT_COMPRESSION "gzip" writes .csv.gz, AUTO_SNAPSHOT_MINUTES 0 = off
+    os.environ["SNAPSHOT_MODE"] = "full"
+    os.environ["SNAPSHOT_COMPRESSION"] = ""
+    os.environ["AUTO_SNAPSHOT_MINUTES"] = "0"
+    # Latency histograms of the hot paths, written on exit (1 = on)
+    os.environ["INSTRUMENTATION"] = "0"
+    os.environ["INSTRUMENTATION_OUTPUT"] = resource_path(
+        os.path.join("..", "instrumentation.json")
     )
-    return files
+    os.environ["PROFILE_OUTPUT"] = ""  # e.g. ../session.prof: cProfile the session
 
+    os.environ.update(preset)
+
+    if not os.path.exists(os.environ["RESULT_FOLDER"]):
+        os.makedirs(os.environ["RESULT_FOLDER"])
+    if not os.path.exists(os.environ["INTERMIN_SAVED"]):
+        os.makedirs(os.environ["INTERMIN_SAVED"])
+
+
+def patch_path(images_path, file_name):
+    return os.path.join(
+        images_path,
+        file_name.split("_top-")[0],
+        os.environ["PATCH_MAGNIFICATION"],
+        file_name,
+    )
+
+
+_reported_fallbacks = set()
+
+
+def reflink_file(source_path, target_path):
+    if sys.platform == "darwin":
+        import ctypes
+
+        libc = ctypes.CDLL("libc.dylib", use_errno=True)
+        if libc.clonefile(os.fsencode(source_path), os.fsencode(target_path), 0):
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), target_path)
+    elif sys.platform.startswith("linux"):
+        import fcntl
+
+        ficlone = 0x40049409
+        try:
+            with open(source_path, "rb") as src, open(target_path, "wb") as dst:
+                fcntl.ioctl(dst.fileno(), ficlone, src.fileno())
+        except OSError:
+            os.remove(target_path)
+            raise
+    else:
+        raise OSError(errno.ENOTSUP, "reflink is not supported", target_path)
+
+
+def materialize_patch(source_path, target_path, mode):
+    # Falls back to a full copy when the filesystem can't link or clone
+    if mode == "virtual":
+        return "virtual"
+
+    if os.path.lexists(target_path):
+        os.remove(target_path)
+
+    data = archived_patch(source_path)
+    if data is not None:
+        # 아카이브 안의 패치는 링크할 원본 파일이 없으므로 바이트를 기록
+        with open(target_path, "wb") as f:
+            f.write(data)
+        return "extract"
+
+    if mode != "copy":
+        try:
+            if mode == "hardlink":
+                os.link(source_path, target_path)
+            elif mode == "symlink":
+                os.symlink(os.path.abspath(source_path), target_path)
+            elif mode == "reflink":
+                reflink_file(source_path, target_path)
+            else:
+                raise ValueError(f"Unknown materialization mode: {mode}")
+            return mode
+        except OSError as e:
+            if mode not in _reported_fallbacks:
+                _reported_fallbacks.add(mode)
+                print(f"{mode} failed for {target_path}, copying instead: {e}")
+
+    shutil.copy(source_path, target_path)
+    return "copy"
 
-def create_classification_csv(image_files, results_path):
-    file_names = [os.path.basename(file_path) for file_path in image_files]
-    classifications = {file_name: [] for file_name in file_names}
-    output_file_path = os.environ["DATABASE"]
+
+def get_patch_table(folder_path):
+    # Only slide folders whose mtime changed since the saved manifest are rescanned
+    return load_patch_table(
+        folder_path,
+        os.environ["PATCH_MAGNIFICATION"],
+        os.environ["MANIFEST"],
+        int(os.environ["SCAN_WORKERS"]),
+    )
+
+
+def stream_patch_table(folder_path):
+    # Per-slide tables for progressive startup, first slide first
+    return stream_patch_tables(
+        folder_path,
+        os.environ["PATCH_MAGNIFICATION"],
+        os.environ["MANIFEST"],
+        int(os.environ["SCAN_WORKERS"]),
+    )
+
+
+def get_sorted_files(folder_path):
+    return get_patch_table(folder_path).paths(folder_path)
+
+
+def scan_result_labels(results_path):
+    labels = {}
 
     for root, _, files in os.walk(results_path):
+        prefix = os.path.basename(root).split("_")[0]
+        if not prefix.isdigit():
+            continue
         for file in files:
-            if file in classifications:
-                parent_folder = os.path.basename(root)
-                prefix = parent_folder.split("_")[0]
-                if prefix.isdigit() and prefix not in classifications[file]:
-                    classifications[file].append(prefix)
+            labels.setdefault(file, set()).add(int(prefix))
+
+    return labels
+
+
+def list_class_folders(results_path):
+    # class id -> result folders with that numeric prefix
+    class_folders = {}
+    with os.scandir(results_path) as entries:
+        for entry in entries:
+            prefix = entry.name.split("_")[0]
+            if prefix.isdigit() and entry.is_dir():
+                class_folders.setdefault(int(prefix), []).append(entry.name)
+    return {class_id: sorted(folders) for class_id, folders in class_folders.items()}
+
+
+def class_folder_signature(results_path, folders):
+    # A directory's mtime and size change whenever entries are added or removed
+    signature = []
+    for folder in folders:
+        stat = os.stat(os.path.join(results_path, folder))
+        signature.append([folder, stat.st_mtime_ns, stat.st_size])
+    return signature
+
+
+def list_class_files(results_path, folders):
+    file_names = set()
+    for folder in folders:
+        with os.scandir(os.path.join(results_path, folder)) as entries:
+            file_names.update(entry.name for entry in entries if entry.is_file())
+    return file_names
+
+
+def scan_classifications(image_files, results_path):
+    file_names = [os.path.basename(file_path) for file_path in image_files]
+    labels = scan_result_labels(results_path)
+
+    return {
+        file_name: [str(class_id) for class_id in sorted(labels.get(file_name, ()))]
+        for file_name in file_names
+    }
+
+
+def create_classification_csv(image_files, results_path):
+    file_names = [os.path.basename(file_path) for file_path in image_files]
+    classifications = scan_classifications(image_files, results_path)
+    output_file_path = os.environ["DATABASE"]
+    import pandas as pd
 
     # ★ 쉼표로 구분된 문자열로 변환
     classification_strings = {
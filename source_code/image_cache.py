@@ -0,0 +1,198 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5.QtCore import QBuffer, QByteArray
+from PyQt5.QtGui import QImage, QImageReader
+from patch_archive import archived_patch
+
+
+def image_reader(image_path):
+    data = archived_patch(image_path)
+    if data is None:
+        return QImageReader(image_path)
+    # mmap 조각을 복사하지 않고 그대로 디코더에 넘김
+    buffer = QBuffer()
+    buffer.setData(QByteArray.fromRawData(data))
+    reader = QImageReader(buffer)
+    reader.source = (buffer, data)  # the reader doesn't own its device
+    return reader
+
+
+def decode_image(image_path):
+    image = image_reader(image_path).read()
+    if image.isNull():
+        return None
+    # QPixmap.fromImage is cheapest for this format, so convert off the GUI thread
+    return image.convertToFormat(QImage.Format_ARGB32_Premultiplied)
+
+
+def decode_region(image_path, clip_rect, scaled_size=None):
+    # Only clip_rect is kept; formats without native support decode then clip
+    reader = image_reader(image_path)
+    reader.setClipRect(clip_rect)
+    if scaled_size is not None:
+        reader.setScaledSize(scaled_size)
+    image = reader.read()
+    if image.isNull():
+        return None
+    return image.convertToFormat(QImage.Format_ARGB32_Premultiplied)
+
+
+def image_bytes(image):
+    return image.sizeInBytes()
+
+
+def pixmap_bytes(pixmap):
+    return pixmap.width() * pixmap.height() * pixmap.depth() // 8
+
+
+class ImageCache:
+    # LRU of decoded images, bounded by the total number of pixel bytes
+    def __init__(self, max_bytes, size_of=image_bytes):
+        self.max_bytes = max_bytes
+        self.size_of = size_of
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._images
+
+    def __len__(self):
+        with self._lock:
+            return len(self._images)
+
+    def get(self, key):
+        with self._lock:
+            image = self._images.get(key)
+            if image is None:
+                self.misses += 1
+                return None
+            self._images.move_to_end(key)
+            self.hits += 1
+            return image
+
+    def count_miss(self):
+        # 캐시를 거치지 않고 직접 디코딩한 경우 (영역 디코딩)
+        with self._lock:
+            self.misses += 1
+
+    def put(self, key, image):
+        size = self.size_of(image)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._images:
+                self.current_bytes -= self.size_of(self._images.pop(key))
+            self._images[key] = image
+            self.current_bytes += size
+
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._images.popitem(last=False)
+                self.current_bytes -= self.size_of(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._images.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._images),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+class DecodeTimes:
+    # Wall time spent producing view pixels, grouped by magnification
+    def __init__(self):
+        self._totals = {}
+        self._lock = threading.Lock()
+
+    def add(self, key, seconds):
+        with self._lock:
+            count, total = self._totals.get(key, (0, 0.0))
+            self._totals[key] = (count + 1, total + seconds)
+
+    def stats(self):
+        with self._lock:
+            return {
+                key: {"count": count, "mean_ms": round(total * 1000 / count, 3)}
+                for key, (count, total) in self._totals.items()
+            }
+
+
+class ImagePrefetcher:
+    def __init__(self, cache, workers=2):
+        self.cache = cache
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="prefetch"
+        )
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def load(self, image_path):
+        image = self.cache.get(image_path)
+        if image is not None:
+            return image
+
+        # 이미 디코딩 중이면 새로 읽지 않고 결과를 기다림
+        with self._lock:
+            future = self._futures.get(image_path)
+            if future is not None and future.cancel():
+                del self._futures[image_path]
+                future = None
+        if future is not None:
+            image = future.result()
+            if image is not None:
+                return image
+
+        image = decode_image(image_path)
+        if image is not None:
+            self.cache.put(image_path, image)
+        return image
+
+    def pending(self, image_path):
+        with self._lock:
+            return image_path in self._futures
+
+    def prefetch(self, image_paths):
+        wanted = set(image_paths)
+        with self._lock:
+            # 윈도우를 벗어난 대기 작업은 취소
+            for image_path, future in list(self._futures.items()):
+                if image_path not in wanted and future.cancel():
+                    del self._futures[image_path]
+
+            for image_path in image_paths:
+                if image_path in self._futures or image_path in self.cache:
+                    continue
+                future = self._executor.submit(self._decode, image_path)
+                self._futures[image_path] = future
+
+    def _decode(self, image_path):
+        try:
+            image = decode_image(image_path)
+            if image is not None:
+                self.cache.put(image_path, image)
+            return image
+        finally:
+            with self._lock:
+                self._futures.pop(image_path, None)
+
+    def shutdown(self):
+        with self._lock:
+            for future in self._futures.values():
+                future.cancel()
+            self._futures.clear()
+        self._executor.shutdown(wait=True)
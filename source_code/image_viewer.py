@@ -1,5 +1,6 @@
 import os
-import pandas as pd
+import math
+import time
 from PyQt5.QtWidgets import (
     QLabel,
     QPushButton,
@@ -12,18 +13,36 @@ from PyQt5.QtWidgets import (
     QDialog,
     QComboBox,
 )
-from PyQt5.QtGui import QPixmap, QColor
-from PyQt5.QtCore import Qt, pyqtSignal
+from PyQt5.QtGui import QPixmap
+from PyQt5.QtCore import Qt, pyqtSignal, QTimer, QRect, QSize
 from functions import resource_path, generate_magnification_dict
+from image_cache import (
+    ImageCache,
+    ImagePrefetcher,
+    DecodeTimes,
+    decode_region,
+    pixmap_bytes,
+)
+from patch_list_model import PatchListModel
+from thumbnail_grid import ThumbnailModel, ThumbnailGrid
+from patch_navigator import PatchNavigator
+from pyramid import level_path, source_size, choose_level
+from spatial_index import SpatialIndex, patch_wsi_size
+from thumbnail_cache import ThumbnailCache
+from context_mosaic import ContextMosaicBuilder
+from instrumentation import timed
 
 
 class ImageViewer(QWidget):
     image_changed = pyqtSignal(str)
+    context_built = pyqtSignal(str, object)
 
-    def __init__(self, df, images_path):
+    def __init__(self, patch_table, images_path, label_index):
         super().__init__()
-        self.image_files = df["file_name"].tolist() if "file_name" in df.columns else []
-        del df
+        self.patch_table = patch_table
+        self.label_index = label_index
+        self.navigator = PatchNavigator(patch_table, label_index)
+        self.score_threshold = float(os.environ["JUMP_SCORE_THRESHOLD"])
 
         with open(resource_path("style/image_viewer.qss"), "r", encoding="utf-8") as f:
             self.setStyleSheet(f.read())
@@ -33,18 +52,95 @@ class ImageViewer(QWidget):
         self.current_magnification = self.default_magnification
         self.images_path = images_path
         self.image_index = 0
+        self.current_image_path = None
         self.pixmap = None
+        self.pixmap_path = None
+        self.grid_mode = False
+
+        # Downsampled levels written by `cli.py pyramid`, used for wide views
+        self.pyramid_folder = os.environ["PYRAMID_FOLDER"]
+        if not self.pyramid_folder or not os.path.isdir(self.pyramid_folder):
+            self.pyramid_folder = None
+        self.pyramid_levels = int(os.environ["PYRAMID_LEVELS"])
+        # 렌더(리사이즈 틱 포함)마다 디스크를 읽지 않도록 크기와 레벨 경로를 기억
+        self.source_sizes = {}
+        self.level_paths = {}
+
+        # 캐시에 없는 패치는 보이는 영역만 라벨 크기로 디코딩
+        self.region_decoding = os.environ["REGION_DECODING"] == "1"
+        self.region_decoded_path = None
+        self.decode_times = DecodeTimes()
+
+        # Decoded patches around the current index are kept in memory
+        self.prefetch_window = int(os.environ["PREFETCH_WINDOW"])
+        self.image_cache = ImageCache(int(os.environ["IMAGE_CACHE_MB"]) * 1024 * 1024)
+        self.prefetcher = ImagePrefetcher(
+            self.image_cache, int(os.environ["PREFETCH_WORKERS"])
+        )
+
+        # (patch, magnification, label size) -> final scaled pixmap
+        self.render_cache = ImageCache(
+            int(os.environ["RENDER_CACHE_MB"]) * 1024 * 1024,
+            size_of=pixmap_bytes,
+        )
+        # Context panel: the current patch among its neighbours at real coordinates
+        self.context_mode = False
+        self.context_radius = int(os.environ["CONTEXT_RADIUS"])
+        self.spatial_index = None
+        self.context_builder = ContextMosaicBuilder(
+            ThumbnailCache(
+                os.environ["THUMBNAIL_FOLDER"],
+                int(os.environ["CONTEXT_TILE_SIZE"]),
+            ),
+            self.context_built.emit,  # 작업 스레드에서 호출되므로 시그널로 넘김
+            int(os.environ["CONTEXT_CACHE_MB"]) * 1024 * 1024,
+        )
+        self.context_built.connect(self.on_context_built)
+
+        # Resizing shows a fast preview; the smooth rescale runs once it settles
+        self.resize_timer = QTimer(self)
+        self.resize_timer.setSingleShot(True)
+        self.resize_timer.setInterval(150)
+        self.resize_timer.timeout.connect(self.rendering_image)
         self.set_ui()
         self.update_ui()
         self.select_default_magnification()
-        QApplication.processEvents()
-        self.update_image()
+        # 패치 목록이 스트리밍되는 경우 첫 슬라이드가 도착할 때 표시
+        if len(self.patch_table):
+            QApplication.processEvents()
+            self.update_image()
+
+    @property
+    def image_files(self):
+        return self.patch_table.names
+
+    def append_patches(self, tables):
+        count = sum(len(table) for table in tables)
+        if not count:
+            return
+        models = [self.patch_model, self.thumbnail_model]
+        starts = [model.begin_append(count) for model in models]
+        self.patch_table.extend(tables)
+        for model, start in zip(models, starts):
+            model.end_append(start)
+        self.navigator.extend(starts[0])
+        if starts[0] == 0:
+            self.image_index = 0
+            self.update_image()
+            self.image_changed.emit(self.image_files[self.image_index])
 
     def set_ui(self):
         self.image_label = QLabel()
         self.file_name_label = QLabel()
         self.image_dropdown = QComboBox()
-        self.image_dropdown.addItems([f.split("_x_")[0] for f in self.image_files])
+        self.patch_model = PatchListModel(self.patch_table, self.label_index, self)
+        self.image_dropdown.setModel(self.patch_model)
+        # 항목 전체를 측정하지 않도록 고정 높이/최소 길이 사용
+        self.image_dropdown.view().setUniformItemSizes(True)
+        self.image_dropdown.setSizeAdjustPolicy(
+            QComboBox.AdjustToMinimumContentsLengthWithIcon
+        )
+        self.image_dropdown.setMinimumContentsLength(24)
         self.image_dropdown.showPopup = self.show_popup_with_update
         self.image_dropdown.currentIndexChanged.connect(self.dropdown_image_change)
         self.info_button = QToolButton()
@@ -52,8 +148,22 @@ class ImageViewer(QWidget):
         self.info_button.setFixedSize(20, 20)
         self.info_button.clicked.connect(self.show_info_popup)
 
+        self.grid_button = QToolButton()
+        self.grid_button.setText("Grid")
+        self.grid_button.setCheckable(True)
+        self.grid_button.setFixedHeight(20)
+        self.grid_button.toggled.connect(self.set_grid_mode)
+
+        self.context_button = QToolButton()
+        self.context_button.setText("Context")
+        self.context_button.setCheckable(True)
+        self.context_button.setFixedHeight(20)
+        self.context_button.toggled.connect(self.set_context_mode)
+
         label_layout = QHBoxLayout()
         label_layout.addWidget(self.file_name_label)
+        label_layout.addWidget(self.grid_button)
+        label_layout.addWidget(self.context_button)
         label_layout.addWidget(self.info_button)
 
         main_layout = QVBoxLayout()
@@ -76,9 +186,30 @@ class ImageViewer(QWidget):
         for button in self.buttons.values():
             mag_button_layout.addWidget(button)
 
+        # 여러 패치를 한 번에 보는 썸네일 모드 (Grid 버튼으로 전환)
+        self.thumbnail_model = ThumbnailModel(
+            self.patch_table, self.label_index, self.images_path, self
+        )
+        self.grid_view = ThumbnailGrid(self.thumbnail_model)
+        self.grid_view.selectionModel().currentChanged.connect(self.grid_image_change)
+        self.grid_view.activated.connect(
+            lambda index: self.grid_button.setChecked(False)
+        )
+        self.grid_view.hide()
+
+        self.mag_button_widget = QWidget()
+        self.mag_button_widget.setLayout(mag_button_layout)
+        mag_button_layout.setContentsMargins(0, 0, 0, 0)
+
         image_layout = QVBoxLayout()
-        image_layout.addLayout(mag_button_layout)
+        image_layout.addWidget(self.mag_button_widget)
         image_layout.addWidget(self.image_label)
+        image_layout.addWidget(self.grid_view)
+
+        self.context_label = QLabel()
+        self.context_label.setAlignment(Qt.AlignCenter)
+        self.context_label.hide()
+        image_layout.addWidget(self.context_label)
 
         self.prev_button = QPushButton("<< Prev")
         self.next_button = QPushButton("Next >>")
@@ -99,42 +230,114 @@ class ImageViewer(QWidget):
         self.update_dropdown_colors()
         QComboBox.showPopup(self.image_dropdown)
 
+    @timed("image_viewer.update_dropdown_colors")
     def update_dropdown_colors(self):
-        csv_path = os.environ["DATABASE"]
-        df = pd.read_csv(csv_path)
+        self.patch_model.refresh_labels()
+
+    def set_grid_mode(self, enabled):
+        self.grid_mode = enabled
+        self.mag_button_widget.setVisible(not enabled)
+        self.image_label.setVisible(not enabled)
+        self.context_label.setVisible(self.context_mode and not enabled)
+        self.grid_view.setVisible(enabled)
+        if enabled:
+            self.grid_view.setFocus()
+        self.update_image()
 
-        for i, (file_name, classification) in enumerate(
-            zip(df["file_name"], df["classification"])
+    def set_context_mode(self, enabled):
+        self.context_mode = enabled
+        self.context_label.setVisible(enabled and not self.grid_mode)
+        if enabled:
+            self.update_context()
+        # 패널이 나타나거나 사라지면 이미지 라벨 크기가 바뀌므로 다시 그림
+        QTimer.singleShot(0, self.rendering_image)
+
+    def context_tiles(self, row):
+        # 현재 패치 주변 context_radius 칸 안의 같은 슬라이드 패치, 먼 것부터
+        if self.spatial_index is None:
+            self.spatial_index = SpatialIndex(
+                self.patch_table, patch_wsi_size(self.image_path_at(row))
+            )
+        table = self.patch_table
+        patch_size = self.spatial_index.patch_size
+        reach = self.context_radius * patch_size
+        x, y = int(table.xs[row]), int(table.ys[row])
+        rows, _ = self.spatial_index.neighbors(row, reach * math.sqrt(2))
+        rows = rows[
+            (abs(table.xs[rows] - x) <= reach) & (abs(table.ys[rows] - y) <= reach)
+        ]
+        tiles = [
+            (
+                self.image_path_at(neighbor),
+                int(table.xs[neighbor]),
+                int(table.ys[neighbor]),
+            )
+            for neighbor in rows[::-1]
+        ]
+        tiles.append((self.image_path_at(row), x, y))
+        return tiles, (x - reach, y - reach), 2 * reach + patch_size, patch_size
+
+    def update_context(self):
+        if not (0 <= self.image_index < len(self.image_files)):
+            return
+        file_name = self.image_files[self.image_index]
+        mosaic = self.context_builder.get(file_name)
+        if mosaic is not None:
+            self.show_context(mosaic)
+            return
+        try:
+            tiles = self.context_tiles(self.image_index)
+        except ValueError as e:
+            self.context_label.setText(f"No context: {e}")
+            return
+        self.context_label.setText("Loading context...")
+        self.context_builder.request(file_name, *tiles)
+
+    def on_context_built(self, file_name, mosaic):
+        if (
+            self.context_mode
+            and 0 <= self.image_index < len(self.image_files)
+            and self.image_files[self.image_index] == file_name
         ):
-            color = (
-                "green"
-                if pd.notna(classification) and str(classification).strip()
-                else "red"
+            self.show_context(mosaic)
+
+    def show_context(self, mosaic):
+        self.context_label.setPixmap(
+            QPixmap.fromImage(mosaic).scaled(
+                self.context_label.width(),
+                self.context_label.height(),
+                aspectRatioMode=Qt.KeepAspectRatio,
+                transformMode=Qt.SmoothTransformation,
             )
-            self.image_dropdown.setItemData(i, QColor(color), Qt.ForegroundRole)
+        )
+
+    def grid_image_change(self, current, previous):
+        if current.isValid() and current.row() != self.image_index:
+            self.show_image_at(current.row())
 
     def dropdown_image_change(self, index):
-        selected_text = self.image_dropdown.currentText()
-        for i, path in enumerate(self.image_files):
-            if path.split("_x_")[0] == selected_text:
-                self.image_index = i
-                self.update_image()
-                self.change_magnification_to_default()
-                self.image_changed.emit(self.image_files[self.image_index])
-                break
+        # update_image가 setCurrentIndex를 호출하므로 같은 위치면 무시
+        if index < 0 or index == self.image_index:
+            return
+        self.image_index = index
+        self.update_image()
+        self.change_magnification_to_default()
+        self.image_changed.emit(self.image_files[self.image_index])
 
     def show_info_popup(self):
+        if not (0 <= self.image_index < len(self.image_files)):
+            return
         dialog = QDialog(self)
         dialog.setWindowTitle("Image Information")
         dialog.setFixedSize(300, 150)
 
-        image_name = self.image_files[self.image_index]
+        table, row = self.patch_table, self.image_index
         info_text = (
             f"<p align='left'>"
-            f"<b>Slide :</b> {image_name[:8]}<br>"
-            f"<b>X Position :</b> {image_name.split('_x_')[1].split('_y_')[0]}<br>"
-            f"<b>Y Position :</b> {image_name.split('_y_')[1].split('_')[0]}<br>"
-            f"<b>Predict Score :</b> {round(float(image_name.split('_')[-1].replace('.png', '')), 5)}"
+            f"<b>Slide :</b> {table.slide_name(row)}<br>"
+            f"<b>X Position :</b> {table.xs[row]}<br>"
+            f"<b>Y Position :</b> {table.ys[row]}<br>"
+            f"<b>Predict Score :</b> {round(float(table.scores[row]), 5)}"
             f"</p>"
         )
 
@@ -158,20 +361,52 @@ class ImageViewer(QWidget):
 
         dialog.exec_()
 
+    def image_path_at(self, index):
+        return self.patch_table.patch_path(self.images_path, index)
+
+    @timed("image_viewer.update_image")
     def update_image(self):
         if 0 <= self.image_index < len(self.image_files):
-            image_path = os.path.join(
-                self.images_path,
-                self.image_files[self.image_index].split("_top-")[0],
-                os.environ["PATCH_MAGNIFICATION"],
-                self.image_files[self.image_index],
-            )
+            image_path = self.image_path_at(self.image_index)
             self.file_name_label.setText(
-                f"<b> Patch Name : {image_path.split('/')[-1].split('_x_')[0]}</b>"
+                f"<b> Patch Name : {self.patch_table.display_text(self.image_index)}</b>"
             )
-            self.pixmap = QPixmap(image_path)
-            self.rendering_image()
+            self.current_image_path = image_path
+            self.pixmap = None  # 렌더 캐시에 없을 때만 디코딩
             self.image_dropdown.setCurrentIndex(self.image_index)
+            if self.grid_mode:
+                # 그리드에서는 큰 이미지를 디코딩하지 않음
+                current = self.thumbnail_model.index(self.image_index)
+                if self.grid_view.currentIndex() != current:
+                    self.grid_view.setCurrentIndex(current)
+                self.grid_view.scrollTo(current)
+                return
+            self.rendering_image()
+            self.prefetch_neighbors()
+            if self.context_mode:
+                self.update_context()
+
+    def prefetch_neighbors(self):
+        count = len(self.image_files)
+        if count < 1 or self.prefetch_window <= 0:
+            return
+
+        # 가까운 순서대로, 다음 이미지를 이전 이미지보다 먼저 요청
+        # 현재 패치도 넣어 영역만 디코딩했더라도 배율 변경/리사이즈는 캐시에서 처리
+        indices = [self.image_index]
+        for offset in range(1, min(self.prefetch_window, count - 1) + 1):
+            for index in (self.image_index + offset, self.image_index - offset):
+                index %= count
+                if index != self.image_index and index not in indices:
+                    indices.append(index)
+        self.prefetcher.prefetch([self.image_path_at(index) for index in indices])
+
+    def shutdown(self):
+        self.prefetcher.shutdown()
+        self.thumbnail_model.shutdown()
+        self.context_builder.shutdown()
+        print(f"Image cache stats: {self.image_cache.stats()}")
+        print(f"Decode time per magnification: {self.decode_times.stats()}")
 
     def update_ui(self):
         font_size = int(14 * self.width() / 435)
@@ -191,18 +426,40 @@ class ImageViewer(QWidget):
                 int(90 / 435 * self.width()), int(30 / 585 * self.height())
             )
         self.layout().setSpacing(int(18 * self.width() / 435))
+        self.context_label.setFixedHeight(int(200 / 585 * self.height()))
 
-    def show_previous_image(self):
-        self.image_index = (self.image_index - 1) % len(self.image_files)
+    def show_image_at(self, index):
+        if index is None:
+            return
+        self.image_index = index
         self.change_magnification_to_default()
         self.update_image()
         self.image_changed.emit(self.image_files[self.image_index])
 
+    def show_previous_image(self):
+        if not len(self.image_files):
+            return
+        self.show_image_at((self.image_index - 1) % len(self.image_files))
+
     def show_next_image(self):
-        self.image_index = (self.image_index + 1) % len(self.image_files)
-        self.change_magnification_to_default()
-        self.update_image()
-        self.image_changed.emit(self.image_files[self.image_index])
+        if not len(self.image_files):
+            return
+        self.show_image_at((self.image_index + 1) % len(self.image_files))
+
+    def show_next_unlabeled(self, step=1):
+        self.show_image_at(self.navigator.next_unlabeled(self.image_index, step))
+
+    def show_next_in_class(self, class_id, step=1):
+        self.show_image_at(
+            self.navigator.next_in_class(class_id, self.image_index, step)
+        )
+
+    def show_next_by_score(self, above=True, step=1):
+        self.show_image_at(
+            self.navigator.next_by_score(
+                self.image_index, self.score_threshold, above, step
+            )
+        )
 
     def change_magnification_to_default(self):
         self.current_magnification = os.environ["DEFAULT_MAGNIFICATION"]
@@ -218,11 +475,98 @@ class ImageViewer(QWidget):
         for mag, button in self.buttons.items():
             button.setChecked(mag == magnification)
 
-    def rendering_image(self):
-        if self.pixmap is None:
+    def load_pixmap(self, image_path):
+        if self.pixmap is None or self.pixmap_path != image_path:
+            image = self.prefetcher.load(image_path)
+            self.pixmap = QPixmap.fromImage(image) if image is not None else QPixmap()
+            self.pixmap_path = image_path
+        return self.pixmap
+
+    def level_image_path(self):
+        # 라벨에 보이는 만큼의 해상도만 가진 가장 작은 레벨을 사용
+        if self.pyramid_folder is None:
+            return self.current_image_path
+        level = choose_level(
+            *self.source_size(self.current_image_path),
+            self.magnifications[self.current_magnification],
+            self.image_label.width(),
+            self.image_label.height(),
+            self.pyramid_levels,
+        )
+        if level == 0:
+            return self.current_image_path
+        key = (self.current_image_path, level)
+        path = self.level_paths.get(key)
+        if path is None:
+            path = level_path(
+                self.pyramid_folder,
+                self.patch_table.slide_name(self.image_index),
+                os.environ["PATCH_MAGNIFICATION"],
+                self.image_files[self.image_index],
+                level,
+            )
+            if not os.path.exists(path):
+                path = self.current_image_path
+            self.level_paths[key] = path
+        return path
+
+    def source_size(self, image_path):
+        size = self.source_sizes.get(image_path)
+        if size is None:
+            size = self.source_sizes[image_path] = source_size(image_path)
+        return size
+
+    @timed("image_viewer.rendering_image")
+    def rendering_image(self, smooth=True):
+        if self.current_image_path is None:
             return
 
-        pixmap = self.pixmap
+        render_key = (
+            self.current_image_path,
+            self.current_magnification,
+            self.image_label.width(),
+            self.image_label.height(),
+        )
+        scaled_pixmap = self.render_cache.get(render_key) if smooth else None
+        if scaled_pixmap is None:
+            scaled_pixmap = self.render_pixmap(
+                Qt.SmoothTransformation if smooth else Qt.FastTransformation
+            )
+            if smooth and not scaled_pixmap.isNull():
+                self.render_cache.put(render_key, scaled_pixmap)
+
+        # 최종적으로 이미지 표시
+        self.image_label.setPixmap(scaled_pixmap)
+        self.image_label.setAlignment(Qt.AlignCenter)
+
+    def render_pixmap(self, transform_mode):
+        image_path = self.level_image_path()
+        started = time.perf_counter()
+        # 디코딩 시간만 기록 (현재 pixmap이나 캐시에서 가져온 경우는 제외)
+        decoding = image_path not in self.image_cache and (
+            self.pixmap is None or self.pixmap_path != image_path
+        )
+        # 영역 디코딩은 패치마다 첫 화면에만, 이후는 전체 이미지 캐시를 사용
+        if (
+            self.region_decoding
+            and decoding
+            and self.region_decoded_path != self.current_image_path
+            and not self.prefetcher.pending(image_path)
+        ):
+            scaled_pixmap = self.decode_view(image_path, transform_mode)
+            if scaled_pixmap is not None:
+                self.image_cache.count_miss()
+                self.region_decoded_path = self.current_image_path
+                self.decode_times.add(
+                    self.current_magnification, time.perf_counter() - started
+                )
+                return scaled_pixmap
+
+        pixmap = self.load_pixmap(image_path)
+        if decoding:
+            self.decode_times.add(
+                self.current_magnification, time.perf_counter() - started
+            )
         original_width, original_height = pixmap.width(), pixmap.height()
 
         # 배율에 맞게 크기를 계산
@@ -245,22 +589,64 @@ class ImageViewer(QWidget):
             self.image_label.width(),
             self.image_label.height(),
             aspectRatioMode=Qt.KeepAspectRatio,
-            transformMode=Qt.SmoothTransformation,
+            transformMode=transform_mode,
         )
-
-        # 최종적으로 이미지 표시
-        self.image_label.setPixmap(scaled_pixmap)
-        self.image_label.setAlignment(Qt.AlignCenter)
+        return scaled_pixmap
+
+    def decode_view(self, image_path, transform_mode):
+        source_width, source_height = self.source_size(image_path)
+        if source_width <= 0 or source_height <= 0:
+            return None
+
+        fraction = self.magnifications[self.current_magnification]
+        crop_width = int(source_width * fraction)
+        crop_height = int(source_height * fraction)
+        clip_rect = QRect(
+            (source_width - crop_width) // 2,
+            (source_height - crop_height) // 2,
+            crop_width,
+            crop_height,
+        )
+        target_size = QSize(crop_width, crop_height).scaled(
+            self.image_label.size(), Qt.KeepAspectRatio
+        )
+        # 축소는 디코더에서, 확대는 기존처럼 pixmap 스케일링으로
+        scaled_size = None
+        if not target_size.isEmpty() and target_size.width() < crop_width:
+            scaled_size = target_size
+
+        image = decode_region(image_path, clip_rect, scaled_size)
+        if image is None:
+            return None
+        pixmap = QPixmap.fromImage(image)
+        if pixmap.size() != target_size:
+            pixmap = pixmap.scaled(
+                self.image_label.width(),
+                self.image_label.height(),
+                aspectRatioMode=Qt.KeepAspectRatio,
+                transformMode=transform_mode,
+            )
+        return pixmap
+
+    def get_selected_image_paths(self):
+        # 그리드에서 Shift/Ctrl로 고른 패치들, 없으면 현재 패치
+        if self.grid_mode:
+            rows = sorted(
+                index.row()
+                for index in self.grid_view.selectionModel().selectedIndexes()
+            )
+            if rows:
+                return [
+                    self.patch_table.patch_path(os.environ["PATCH_FOLDER"], row)
+                    for row in rows
+                ]
+        return [self.get_current_image_path()]
 
     def get_current_image_path(self):
         if 0 <= self.image_index < len(self.image_files):
-            image_path = os.path.join(
-                os.environ["PATCH_FOLDER"],
-                self.image_files[self.image_index].split("_top-")[0],
-                os.environ["PATCH_MAGNIFICATION"],
-                self.image_files[self.image_index],
+            return self.patch_table.patch_path(
+                os.environ["PATCH_FOLDER"], self.image_index
             )
-            return image_path
         return None
 
     def select_default_magnification(self):
@@ -268,6 +654,7 @@ class ImageViewer(QWidget):
 
     def resizeEvent(self, event):
         self.update_ui()
-        self.update_image()
+        self.rendering_image(smooth=False)
+        self.resize_timer.start()
 
         super().resizeEvent(event)
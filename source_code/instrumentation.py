@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import bisect
+import cProfile
+import threading
+import functools
+from contextlib import contextmanager
+
+# INSTRUMENTATION=1 records latency histograms of the wrapped operations and
+# writes them to INSTRUMENTATION_OUTPUT on exit; PROFILE_OUTPUT=path.prof
+# captures a cProfile of the whole session. Both are off by default.
+
+BUCKET_BOUNDS_MS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500]
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def add(self, elapsed_ms):
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS_MS, elapsed_ms)] += 1
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def percentile(self, fraction):
+        # 버킷 상한값으로 근사
+        threshold = fraction * self.count
+        seen = 0
+        for position, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= threshold:
+                if position < len(BUCKET_BOUNDS_MS):
+                    return min(BUCKET_BOUNDS_MS[position], self.max_ms)
+                return self.max_ms
+        return self.max_ms
+
+    def to_dict(self):
+        labels = [f"<={bound}ms" for bound in BUCKET_BOUNDS_MS]
+        labels.append(f">{BUCKET_BOUNDS_MS[-1]}ms")
+        return {
+            "count": self.count,
+            "total_ms": round(self.total_ms, 3),
+            "mean_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "max_ms": round(self.max_ms, 3),
+            "p50_ms": round(self.percentile(0.5), 3),
+            "p95_ms": round(self.percentile(0.95), 3),
+            "buckets": {
+                label: bucket_count
+                for label, bucket_count in zip(labels, self.counts)
+                if bucket_count
+            },
+        }
+
+
+_histograms = {}
+_lock = threading.Lock()
+_enabled = None
+_profiler = None
+
+
+def enabled():
+    # configure_environment() 이후 첫 호출에서 한 번만 읽음
+    global _enabled
+    if _enabled is None:
+        _enabled = os.environ["INSTRUMENTATION"] == "1"
+    return _enabled
+
+
+def record(name, elapsed_seconds):
+    if not enabled():
+        return
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = LatencyHistogram()
+        histogram.add(elapsed_seconds * 1000)
+
+
+@contextmanager
+def measure(name):
+    if not enabled():
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started)
+
+
+def timed(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled():
+                return func(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - started)
+
+        return wrapper
+
+    return decorator
+
+
+def snapshot():
+    with _lock:
+        return {name: histogram.to_dict() for name, histogram in _histograms.items()}
+
+
+def dump(path=None):
+    path = path or os.environ["INSTRUMENTATION_OUTPUT"]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(snapshot(), f, indent=2, sort_keys=True)
+    print(f"Instrumentation written to: {path}")
+    return path
+
+
+def start_profile():
+    global _profiler
+    if os.environ["PROFILE_OUTPUT"] and _profiler is None:
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+
+
+def stop_profile():
+    global _profiler
+    if _profiler is not None:
+        _profiler.disable()
+        _profiler.dump_stats(os.environ["PROFILE_OUTPUT"])
+        print(f"Profile written to: {os.environ['PROFILE_OUTPUT']}")
+        _profiler = None
+
+
+def finish():
+    stop_profile()
+    if enabled():
+        dump()
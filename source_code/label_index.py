@@ -0,0 +1,83 @@
+import threading
+
+
+class LabelIndex:
+    # file name -> set of class ids, kept in step with the annotation store
+    def __init__(self, labels=None):
+        self.labels = {}
+        self.version = 0
+        self.listeners = []
+        self._lock = threading.Lock()
+        if labels:
+            self.replace(labels)
+
+    @classmethod
+    def from_store(cls, annotation_store):
+        return cls(
+            {
+                file_name: class_ids
+                for file_name, class_ids in annotation_store.items()
+                if class_ids
+            }
+        )
+
+    def add_listener(self, callback):
+        # callback(file_name) after a change; file_name is None when many changed
+        self.listeners.append(callback)
+
+    def notify(self, file_name):
+        for callback in self.listeners:
+            callback(file_name)
+
+    def classes_of(self, file_name):
+        return frozenset(self.labels.get(file_name, ()))
+
+    def is_labeled(self, file_name):
+        return bool(self.labels.get(file_name))
+
+    def snapshot(self):
+        with self._lock:
+            labels = {
+                file_name: set(class_ids)
+                for file_name, class_ids in self.labels.items()
+            }
+            return labels, self.version
+
+    def add(self, file_name, class_id):
+        with self._lock:
+            self.labels.setdefault(file_name, set()).add(int(class_id))
+            self.version += 1
+        self.notify(file_name)
+
+    def remove(self, file_name, class_id):
+        with self._lock:
+            class_ids = self.labels.get(file_name)
+            if class_ids is not None:
+                class_ids.discard(int(class_id))
+                if not class_ids:
+                    del self.labels[file_name]
+            self.version += 1
+        self.notify(file_name)
+
+    def remove_class(self, class_id):
+        with self._lock:
+            for file_name in list(self.labels):
+                self.labels[file_name].discard(int(class_id))
+                if not self.labels[file_name]:
+                    del self.labels[file_name]
+            self.version += 1
+        self.notify(None)
+
+    def replace(self, labels, expected_version=None):
+        # expected_version 이후에 변경이 있었다면 (스캔 도중 클릭) 덮어쓰지 않음
+        with self._lock:
+            if expected_version is not None and expected_version != self.version:
+                return False
+            self.labels = {
+                file_name: {int(class_id) for class_id in class_ids}
+                for file_name, class_ids in labels.items()
+                if class_ids
+            }
+            self.version += 1
+        self.notify(None)
+        return True
@@ -0,0 +1,125 @@
+import os
+import json
+import mmap
+import struct
+import threading
+
+# Slide_xxx/20X.pack: header, concatenated PNG blobs, then a JSON index
+#   magic (8 bytes) | index offset (u64) | index length (u64) | blobs | index
+MAGIC = b"PPACK\x00\x01\n"
+HEADER = struct.Struct("<8sQQ")
+ARCHIVE_SUFFIX = ".pack"
+
+
+def archive_path(patch_dir):
+    return patch_dir.rstrip(os.sep) + ARCHIVE_SUFFIX
+
+
+def write_archive(patch_dir, target_path=None):
+    target_path = target_path or archive_path(patch_dir)
+    names = sorted(
+        entry.name
+        for entry in os.scandir(patch_dir)
+        if entry.name.endswith(".png")
+        and not entry.name.startswith(".")
+        and entry.is_file()
+    )
+
+    index = []
+    tmp_path = f"{target_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(b"\0" * HEADER.size)
+        for name in names:
+            with open(os.path.join(patch_dir, name), "rb") as patch:
+                data = patch.read()
+            index.append([name, f.tell(), len(data)])
+            f.write(data)
+
+        index_offset = f.tell()
+        index_data = json.dumps(index, separators=(",", ":")).encode("utf-8")
+        f.write(index_data)
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, index_offset, len(index_data)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, target_path)
+    return len(index)
+
+
+class PatchArchive:
+    # Read-only mmap of one .pack file; patches are returned as memoryviews
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, index_offset, index_length = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC:
+            raise ValueError(f"Not a patch archive: {path}")
+        index = json.loads(self._mmap[index_offset : index_offset + index_length])
+        self.entries = {name: (offset, length) for name, offset, length in index}
+        self._view = memoryview(self._mmap)
+
+    def names(self):
+        return list(self.entries)
+
+    def read(self, name):
+        entry = self.entries.get(name)
+        if entry is None:
+            return None
+        offset, length = entry
+        return self._view[offset : offset + length]
+
+
+def verify_archive(patch_dir, path=None):
+    # 같은 파일 목록이고 모든 패치의 바이트가 폴더의 PNG와 같을 때만 True
+    archive = PatchArchive(path or archive_path(patch_dir))
+    loose = sorted(
+        entry.name
+        for entry in os.scandir(patch_dir)
+        if entry.name.endswith(".png")
+        and not entry.name.startswith(".")
+        and entry.is_file()
+    )
+    if loose != sorted(archive.entries):
+        return False
+    for name in loose:
+        with open(os.path.join(patch_dir, name), "rb") as patch:
+            if patch.read() != archive.read(name):
+                return False
+    return True
+
+
+_archives = {}
+_archives_lock = threading.Lock()
+
+
+def open_archive(patch_dir):
+    # One stat per slide folder; archives stay mapped for the process lifetime
+    with _archives_lock:
+        if patch_dir not in _archives:
+            path = archive_path(patch_dir)
+            _archives[patch_dir] = PatchArchive(path) if os.path.isfile(path) else None
+        return _archives[patch_dir]
+
+
+def archived_patch(image_path):
+    # image_path is the usual Slide_xxx/20X/name.png path, packed or not
+    archive = open_archive(os.path.dirname(image_path))
+    if archive is None:
+        return None
+    return archive.read(os.path.basename(image_path))
+
+
+def patch_mtime_ns(image_path):
+    archive = open_archive(os.path.dirname(image_path))
+    if archive is not None and os.path.basename(image_path) in archive.entries:
+        return os.stat(archive.path).st_mtime_ns
+    return os.stat(image_path).st_mtime_ns
+
+
+def read_patch_bytes(image_path):
+    data = archived_patch(image_path)
+    if data is not None:
+        return data
+    with open(image_path, "rb") as f:
+        return f.read()
@@ -0,0 +1,50 @@
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex
+from PyQt5.QtGui import QColor
+
+
+class PatchListModel(QAbstractListModel):
+    # Display text and label colour are computed only for rows a view asks for
+    def __init__(self, patch_table, label_index, parent=None):
+        super().__init__(parent)
+        self.patch_table = patch_table
+        self.label_index = label_index
+        self.labeled_color = QColor("green")
+        self.unlabeled_color = QColor("red")
+
+    @property
+    def image_files(self):
+        # 스트리밍 로딩 중 테이블 배열이 교체되므로 매번 테이블에서 읽음
+        return self.patch_table.names
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.image_files)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+
+        row = index.row()
+        if role == Qt.DisplayRole:
+            return self.patch_table.display_text(row)
+        if role == Qt.ForegroundRole:
+            if self.label_index.is_labeled(self.image_files[row]):
+                return self.labeled_color
+            return self.unlabeled_color
+        return None
+
+    def begin_append(self, count):
+        start = len(self.image_files)
+        self.beginInsertRows(QModelIndex(), start, start + count - 1)
+        return start
+
+    def end_append(self, start):
+        self.endInsertRows()
+
+    def refresh_labels(self):
+        # 보이는 행만 다시 그려지므로 전체 범위를 알려도 비용이 작음
+        if len(self.image_files):
+            self.dataChanged.emit(
+                self.index(0),
+                self.index(len(self.image_files) - 1),
+                [Qt.ForegroundRole],
+            )
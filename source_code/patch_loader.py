@@ -0,0 +1,55 @@
+import time
+import threading
+from PyQt5.QtCore import QObject, pyqtSignal
+
+
+class PatchLoader(QObject):
+    # Streams per-slide PatchTables from a worker thread into the GUI thread
+    patches_loaded = pyqtSignal(object)
+    loading_finished = pyqtSignal(object)  # every table, or None if not completed
+
+    def __init__(self, stream, batch_seconds=0.1, parent=None):
+        super().__init__(parent)
+        self.stream = stream
+        self.batch_seconds = batch_seconds
+        self.done = False
+        self.stopped = threading.Event()
+        self.thread = None
+        self.loading_finished.connect(self.mark_done)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        tables, batch = [], []
+        flushed = None
+        result = None
+        try:
+            for table in self.stream:
+                if self.stopped.is_set():
+                    return
+                tables.append(table)
+                batch.append(table)
+                # 첫 슬라이드는 바로, 이후는 모아서 보내 모델 갱신 횟수를 줄임
+                if flushed is None or time.monotonic() - flushed >= self.batch_seconds:
+                    self.patches_loaded.emit(batch)
+                    batch = []
+                    flushed = time.monotonic()
+            if batch:
+                self.patches_loaded.emit(batch)
+            result = tables
+        except Exception as e:
+            print(f"Patch loading failed: {e}")
+        finally:
+            # 중단된 경우 스트림을 닫아 남은 슬라이드 스캔을 취소
+            self.stream.close()
+            self.loading_finished.emit(result)
+
+    def mark_done(self, result):
+        self.done = True
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
@@ -0,0 +1,186 @@
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from patch_table import PatchTable, parse_patch_name, slide_number
+from patch_archive import ARCHIVE_SUFFIX, PatchArchive, archive_path
+
+MANIFEST_VERSION = 2
+# 디렉터리 mtime 해상도 안에서 바뀐 폴더는 다음 실행 때 다시 스캔
+MTIME_SETTLE_SECONDS = 2
+
+
+def settle_mtime(mtime_ns):
+    # 방금 바뀐 mtime은 믿을 수 없으므로 None으로 저장해 다음 실행 때 다시 확인
+    settle_ns = (time.time() - MTIME_SETTLE_SECONDS) * 1e9
+    return mtime_ns if mtime_ns < settle_ns else None
+
+
+def scan_patch_dir(patch_dir):
+    patches = []
+    with os.scandir(patch_dir) as entries:
+        for entry in entries:
+            name = entry.name
+            if name.startswith(".") or not name.endswith(".png"):
+                continue
+            if entry.is_file():
+                patches.append(parse_patch_name(name))
+    return patches
+
+
+def scan_patch_source(source_path):
+    # 슬라이드에 .pack이 있으면 폴더 대신 아카이브 인덱스를 사용
+    if source_path.endswith(ARCHIVE_SUFFIX):
+        return [parse_patch_name(name) for name in PatchArchive(source_path).names()]
+    return scan_patch_dir(source_path)
+
+
+class PatchManifest:
+    # Parsed patch list of image_path, with per-slide directory mtimes
+    def __init__(self, folder_path, magnification, manifest_path=None):
+        self.folder_path = folder_path
+        self.magnification = magnification
+        self.manifest_path = manifest_path
+        self.slides = {}
+        self.rescanned = []
+        self.changed = False
+        self.loaded = False
+
+    def load(self):
+        self.loaded = True
+        if not self.manifest_path or not os.path.exists(self.manifest_path):
+            return
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable manifest {self.manifest_path}: {e}")
+            return
+
+        if (
+            data.get("version") == MANIFEST_VERSION
+            and data.get("folder") == os.path.abspath(self.folder_path)
+            and data.get("magnification") == self.magnification
+        ):
+            self.slides = data["slides"]
+
+    def save(self):
+        if not self.manifest_path:
+            return
+        data = {
+            "version": MANIFEST_VERSION,
+            "folder": os.path.abspath(self.folder_path),
+            "magnification": self.magnification,
+            "slides": self.slides,
+        }
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp_path, self.manifest_path)
+
+    def sources(self):
+        current = {}
+        with os.scandir(self.folder_path) as entries:
+            for entry in entries:
+                if entry.name.startswith(".") or not entry.is_dir():
+                    continue
+                patch_dir = os.path.join(entry.path, self.magnification)
+                for source_path in (archive_path(patch_dir), patch_dir):
+                    try:
+                        mtime_ns = os.stat(source_path).st_mtime_ns
+                    except OSError:
+                        continue
+                    current[entry.name] = (source_path, mtime_ns)
+                    break
+        return current
+
+    def store(self, slide, mtime_ns, patches):
+        self.slides[slide] = {
+            "mtime_ns": settle_mtime(mtime_ns),
+            "patches": patches,
+        }
+
+    def stream(self, workers=8, executor_class=ThreadPoolExecutor):
+        # Yields (slide, patches) in slide order. The first slide is read from
+        # disk before the saved manifest is parsed, so it is available at once.
+        current = self.sources()
+        ordered = sorted(current, key=slide_number)
+        stale = []
+        if ordered:
+            first = ordered[0]
+            first_patches = scan_patch_source(current[first][0])
+            yield first, first_patches
+
+        if not self.loaded:
+            self.load()
+        if ordered:
+            if self.slides.get(first, {}).get("mtime_ns") != current[first][1]:
+                self.store(first, current[first][1], first_patches)
+                stale.append(first)
+
+        rest = [
+            slide
+            for slide in ordered[1:]
+            if self.slides.get(slide, {}).get("mtime_ns") != current[slide][1]
+        ]
+        executor = executor_class(max_workers=workers)
+        try:
+            # map은 순서대로 결과를 내므로 앞 슬라이드부터 바로 전달됨
+            scanned = executor.map(
+                scan_patch_source, [current[slide][0] for slide in rest]
+            )
+            rest = set(rest)
+            for slide in ordered[1:]:
+                if slide in rest:
+                    self.store(slide, current[slide][1], next(scanned))
+                    stale.append(slide)
+                yield slide, self.slides[slide]["patches"]
+        finally:
+            # 도중에 닫히면 아직 시작하지 않은 스캔은 취소하고 진행 중인 것만 기다림
+            executor.shutdown(cancel_futures=True)
+
+        removed = [slide for slide in self.slides if slide not in current]
+        for slide in removed:
+            del self.slides[slide]
+        self.rescanned = stale
+        self.changed = bool(stale or removed)
+
+    def refresh(self, workers=8, executor_class=ThreadPoolExecutor):
+        for _ in self.stream(workers, executor_class):
+            pass
+        return self.changed
+
+    def table(self):
+        # 스캔 때 파싱한 필드를 그대로 쓰므로 파일명을 다시 파싱하지 않음
+        return PatchTable.from_records(
+            [patch for info in self.slides.values() for patch in info["patches"]]
+        ).sorted()
+
+
+def load_patch_table(
+    folder_path,
+    magnification,
+    manifest_path=None,
+    workers=8,
+    executor_class=ThreadPoolExecutor,
+):
+    manifest = PatchManifest(folder_path, magnification, manifest_path)
+    manifest.load()
+    if manifest.refresh(workers, executor_class):
+        manifest.save()
+    return manifest.table()
+
+
+def stream_patch_tables(
+    folder_path,
+    magnification,
+    manifest_path=None,
+    workers=8,
+    executor_class=ThreadPoolExecutor,
+):
+    # One sorted PatchTable per slide; concatenated in order they equal table()
+    manifest = PatchManifest(folder_path, magnification, manifest_path)
+    for _, patches in manifest.stream(workers, executor_class):
+        yield PatchTable.from_records(patches).sorted()
+    if manifest.changed:
+        manifest.save()
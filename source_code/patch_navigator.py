@@ -0,0 +1,115 @@
+import bisect
+import threading
+import numpy as np
+
+
+def step_from(rows, current, step):
+    # rows is sorted; wraps around like the Previous/Next buttons
+    if len(rows) == 0:
+        return None
+    if step > 0:
+        position = bisect.bisect_right(rows, current)
+        return int(rows[position % len(rows)])
+    position = bisect.bisect_left(rows, current) - 1
+    return int(rows[position])
+
+
+class PatchNavigator:
+    # Sorted row lists per label state, so every jump is a bisect
+    def __init__(self, patch_table, label_index, score_cache_size=8):
+        self.patch_table = patch_table
+        self.label_index = label_index
+        self.score_cache_size = score_cache_size
+        self.unlabeled = []
+        self.class_rows = {}
+        self.row_classes = {}
+        self._score_rows = {}
+        self._lock = threading.Lock()
+        self.rebuild()
+        label_index.add_listener(self.on_labels_changed)
+
+    def rebuild(self):
+        labels, _ = self.label_index.snapshot()
+        labeled = np.zeros(len(self.patch_table), dtype=bool)
+        class_rows = {}
+        row_classes = {}
+        for file_name, class_ids in labels.items():
+            row = self.patch_table.row_of(file_name)
+            if row < 0 or not class_ids:
+                continue
+            labeled[row] = True
+            row_classes[row] = set(class_ids)
+            for class_id in class_ids:
+                class_rows.setdefault(class_id, []).append(row)
+
+        with self._lock:
+            self.unlabeled = np.flatnonzero(~labeled).tolist()
+            self.class_rows = {
+                class_id: sorted(rows) for class_id, rows in class_rows.items()
+            }
+            self.row_classes = row_classes
+
+    def extend(self, start):
+        # 뒤에 붙은 행은 모든 기존 행보다 크므로 append만으로 정렬이 유지됨
+        with self._lock:
+            for row in range(start, len(self.patch_table)):
+                class_ids = self.label_index.classes_of(self.patch_table.names[row])
+                if not class_ids:
+                    self.unlabeled.append(row)
+                    continue
+                self.row_classes[row] = set(class_ids)
+                for class_id in class_ids:
+                    self.class_rows.setdefault(class_id, []).append(row)
+            self._score_rows.clear()
+
+    def on_labels_changed(self, file_name):
+        if file_name is None:
+            self.rebuild()
+            return
+        row = self.patch_table.row_of(file_name)
+        if row < 0:
+            return
+
+        new_classes = set(self.label_index.classes_of(file_name))
+        with self._lock:
+            old_classes = self.row_classes.get(row, set())
+            for class_id in old_classes - new_classes:
+                rows = self.class_rows[class_id]
+                del rows[bisect.bisect_left(rows, row)]
+            for class_id in new_classes - old_classes:
+                bisect.insort(self.class_rows.setdefault(class_id, []), row)
+
+            if old_classes and not new_classes:
+                bisect.insort(self.unlabeled, row)
+            elif new_classes and not old_classes:
+                del self.unlabeled[bisect.bisect_left(self.unlabeled, row)]
+
+            if new_classes:
+                self.row_classes[row] = new_classes
+            else:
+                self.row_classes.pop(row, None)
+
+    def next_unlabeled(self, current, step=1):
+        with self._lock:
+            return step_from(self.unlabeled, current, step)
+
+    def next_in_class(self, class_id, current, step=1):
+        with self._lock:
+            return step_from(self.class_rows.get(int(class_id), []), current, step)
+
+    def score_rows(self, threshold, above=True):
+        # 임계값이 바뀔 때만 O(n)으로 다시 계산
+        key = (float(threshold), above)
+        rows = self._score_rows.get(key)
+        if rows is None:
+            if above:
+                rows = self.patch_table.rows_where(min_score=threshold)
+            else:
+                rows = self.patch_table.rows_where(max_score=threshold)
+            if len(self._score_rows) >= self.score_cache_size:
+                self._score_rows.clear()
+            self._score_rows[key] = rows
+        return rows
+
+    def next_by_score(self, current, threshold, above=True, step=1):
+        return step_from(self.score_rows(threshold, above), current, step)
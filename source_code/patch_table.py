@@ -0,0 +1,167 @@
+import os
+import sys
+import numpy as np
+
+
+def parse_patch_name(file_name):
+    # Slide_{Slide_num}_top-{rank}_x_{x}_y_{y}_{prediction value}.png
+    slide_name, _, rest = file_name.partition("_top-")
+    rank, _, rest = rest.partition("_x_")
+    x, _, rest = rest.partition("_y_")
+    y, _, score = rest.partition("_")
+    return [
+        file_name,
+        slide_name,
+        int(rank),
+        int(x),
+        int(y),
+        float(os.path.splitext(score)[0]),
+        file_name.index("_x_"),
+    ]
+
+
+def slide_number(slide_name):
+    # "Slide_{Slide_num}" -> Slide_num
+    return int(slide_name.split("_")[1])
+
+
+class PatchTable:
+    # Struct-of-arrays view of the patch file names, parsed once at load
+    def __init__(self, names, slide_names, slide_codes, ranks, xs, ys, scores, prefix):
+        self.names = names
+        self.slide_names = slide_names
+        self.slide_codes = slide_codes
+        self.ranks = ranks
+        self.xs = xs
+        self.ys = ys
+        self.scores = scores
+        self.prefix = prefix
+        self._rows_by_name = None
+
+    @classmethod
+    def from_records(cls, records):
+        # records: parse_patch_name() rows
+        slide_names = []
+        slide_lookup = {}
+        names = np.empty(len(records), dtype=object)
+        slide_codes = np.empty(len(records), dtype=np.int32)
+        ranks = np.empty(len(records), dtype=np.int32)
+        xs = np.empty(len(records), dtype=np.int64)
+        ys = np.empty(len(records), dtype=np.int64)
+        scores = np.empty(len(records), dtype=np.float64)
+        prefix = np.empty(len(records), dtype=np.int16)
+
+        for row, (name, slide_name, rank, x, y, score, prefix_len) in enumerate(
+            records
+        ):
+            code = slide_lookup.get(slide_name)
+            if code is None:
+                code = slide_lookup[slide_name] = len(slide_names)
+                slide_names.append(slide_name)
+            names[row] = sys.intern(name)
+            slide_codes[row] = code
+            ranks[row] = rank
+            xs[row] = x
+            ys[row] = y
+            scores[row] = score
+            prefix[row] = prefix_len
+
+        return cls(names, slide_names, slide_codes, ranks, xs, ys, scores, prefix)
+
+    @classmethod
+    def from_file_names(cls, file_names):
+        return cls.from_records([parse_patch_name(name) for name in file_names])
+
+    def __len__(self):
+        return len(self.names)
+
+    def take(self, rows):
+        return PatchTable(
+            self.names[rows],
+            self.slide_names,
+            self.slide_codes[rows],
+            self.ranks[rows],
+            self.xs[rows],
+            self.ys[rows],
+            self.scores[rows],
+            self.prefix[rows],
+        )
+
+    def sorted(self):
+        # 기존 정렬 키와 동일: (슬라이드 번호, int("top-N"[3:]) = -N)
+        slide_numbers = np.array(
+            [slide_number(slide_name) for slide_name in self.slide_names],
+            dtype=np.int64,
+        )
+        order = np.lexsort((-self.ranks, slide_numbers[self.slide_codes]))
+        return self.take(order)
+
+    def extend(self, tables):
+        # 스트리밍 로딩: 새 행은 뒤에만 붙으므로 기존 행 번호는 그대로 유지
+        tables = [table for table in tables if len(table)]
+        if not tables:
+            return
+        start = len(self)
+        slide_codes = [self.slide_codes]
+        for table in tables:
+            remap = np.empty(len(table.slide_names), dtype=np.int32)
+            for code, slide_name in enumerate(table.slide_names):
+                if slide_name not in self.slide_names:
+                    self.slide_names.append(slide_name)
+                remap[code] = self.slide_names.index(slide_name)
+            slide_codes.append(remap[table.slide_codes])
+
+        self.names = np.concatenate([self.names] + [table.names for table in tables])
+        self.slide_codes = np.concatenate(slide_codes)
+        for column in ["ranks", "xs", "ys", "scores", "prefix"]:
+            setattr(
+                self,
+                column,
+                np.concatenate(
+                    [getattr(self, column)]
+                    + [getattr(table, column) for table in tables]
+                ),
+            )
+        if self._rows_by_name is not None:
+            for row in range(start, len(self)):
+                self._rows_by_name[self.names[row]] = row
+
+    def slide_name(self, row):
+        return self.slide_names[self.slide_codes[row]]
+
+    def display_text(self, row):
+        return self.names[row][: self.prefix[row]]
+
+    def patch_path(self, images_path, row):
+        return os.path.join(
+            images_path,
+            self.slide_name(row),
+            os.environ["PATCH_MAGNIFICATION"],
+            self.names[row],
+        )
+
+    def paths(self, images_path):
+        return [self.patch_path(images_path, row) for row in range(len(self))]
+
+    def row_of(self, file_name):
+        if self._rows_by_name is None:
+            self._rows_by_name = {name: row for row, name in enumerate(self.names)}
+        return self._rows_by_name.get(file_name, -1)
+
+    def rows_where(
+        self, min_score=None, max_score=None, x_range=None, y_range=None, slide=None
+    ):
+        mask = np.ones(len(self), dtype=bool)
+        if min_score is not None:
+            mask &= self.scores >= min_score
+        if max_score is not None:
+            mask &= self.scores <= max_score
+        if x_range is not None:
+            mask &= (self.xs >= x_range[0]) & (self.xs <= x_range[1])
+        if y_range is not None:
+            mask &= (self.ys >= y_range[0]) & (self.ys <= y_range[1])
+        if slide is not None:
+            if slide not in self.slide_names:
+                return np.empty(0, dtype=np.int64)
+            mask &= self.slide_codes == self.slide_names.index(slide)
+        return np.flatnonzero(mask)
@@ -0,0 +1,64 @@
+import os
+from PyQt5.QtCore import Qt
+from image_cache import image_reader
+from patch_archive import patch_mtime_ns
+
+# Level k holds the patch downsampled by 2**k; level 0 is the original PNG
+
+
+def level_path(pyramid_folder, slide_name, magnification, file_name, level):
+    return os.path.join(
+        pyramid_folder, slide_name, magnification, f"L{level}", file_name
+    )
+
+
+def source_size(image_path):
+    # PNG 헤더만 읽음
+    size = image_reader(image_path).size()
+    return size.width(), size.height()
+
+
+def choose_level(
+    source_width, source_height, crop_fraction, target_width, target_height, levels
+):
+    # Coarsest level that still has at least one pixel per displayed pixel
+    if source_width <= 0 or target_width <= 0 or target_height <= 0:
+        return 0
+    ratio = min(
+        source_width * crop_fraction / target_width,
+        source_height * crop_fraction / target_height,
+    )
+    level = 0
+    while level < levels and ratio >= 2:
+        ratio /= 2
+        level += 1
+    return level
+
+
+def build_levels(source_path, target_paths):
+    # target_paths[k - 1] receives level k; up-to-date levels are left alone
+    source_mtime = patch_mtime_ns(source_path)
+    if all(
+        os.path.exists(target) and os.stat(target).st_mtime_ns >= source_mtime
+        for target in target_paths
+    ):
+        return 0
+
+    image = image_reader(source_path).read()
+    if image.isNull():
+        print(f"Skipping unreadable patch {source_path}")
+        return 0
+
+    for target in target_paths:
+        image = image.scaled(
+            max(1, image.width() // 2),
+            max(1, image.height() // 2),
+            Qt.IgnoreAspectRatio,
+            Qt.SmoothTransformation,
+        )
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp_path = f"{target}.tmp"
+        if not image.save(tmp_path, "PNG"):
+            raise OSError(f"Could not write {tmp_path}")
+        os.replace(tmp_path, target)
+    return len(target_paths)
@@ -0,0 +1,155 @@
+import os
+import datetime
+import threading
+import numpy as np
+
+# pandas는 스냅샷을 쓰거나 읽을 때만 불러옴 (시작 경로에서 제외)
+# Intermin_Saved/saved_{timestamp}.csv[.gz]       : every labelled patch x class ("O")
+# Intermin_Saved/saved_{timestamp}.diff.csv[.gz]  : file_name, class_id, change (+/-)
+#   relative to the snapshot written just before it
+
+
+def snapshot_frame(labels, class_ids=()):
+    import pandas as pd
+
+    pairs = [
+        (file_name, class_id)
+        for file_name, file_class_ids in labels.items()
+        for class_id in file_class_ids
+    ]
+    columns = sorted({int(class_id) for class_id in class_ids} | {c for _, c in pairs})
+    if not pairs:
+        return pd.DataFrame(columns=[str(column) for column in columns])
+
+    long_form = pd.DataFrame(pairs, columns=["file_name", "class_id"])
+    counts = pd.crosstab(long_form["file_name"], long_form["class_id"]).reindex(
+        columns=columns, fill_value=0
+    )
+    frame = pd.DataFrame(
+        np.where(counts.to_numpy() > 0, "O", ""),
+        index=counts.index,
+        columns=[str(column) for column in columns],
+    )
+    frame.index.name = None
+    return frame
+
+
+def label_pairs(labels):
+    return {
+        (file_name, int(class_id))
+        for file_name, class_ids in labels.items()
+        for class_id in class_ids
+    }
+
+
+def is_diff_snapshot(path):
+    return ".diff.csv" in os.path.basename(path)
+
+
+def snapshot_path(itermin_saved, differential=False, compression=""):
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    suffix = (".diff" if differential else "") + ".csv"
+    if compression == "gzip":
+        suffix += ".gz"
+    save_path = os.path.join(itermin_saved, f"saved_{timestamp}{suffix}")
+    counter = 1
+    while os.path.exists(save_path):
+        save_path = os.path.join(itermin_saved, f"saved_{timestamp}_{counter}{suffix}")
+        counter += 1
+    return save_path
+
+
+def save_classification_state(labels, class_ids, itermin_saved, compression=""):
+    save_path = snapshot_path(itermin_saved, compression=compression)
+    snapshot_frame(labels, class_ids).to_csv(save_path, encoding="utf-8-sig")
+    print(f"Classification state saved to: {save_path}")
+    return save_path
+
+
+def save_classification_diff(previous, labels, itermin_saved, compression=""):
+    import pandas as pd
+
+    previous_pairs, current_pairs = label_pairs(previous), label_pairs(labels)
+    changes = [(*pair, "+") for pair in current_pairs - previous_pairs]
+    changes += [(*pair, "-") for pair in previous_pairs - current_pairs]
+    if not changes:
+        print("No label changes since the previous snapshot")
+        return None
+
+    save_path = snapshot_path(itermin_saved, True, compression)
+    pd.DataFrame(sorted(changes), columns=["file_name", "class_id", "change"]).to_csv(
+        save_path, index=False, encoding="utf-8-sig"
+    )
+    print(f"Classification changes ({len(changes)}) saved to: {save_path}")
+    return save_path
+
+
+class SnapshotWriter:
+    # "differential" mode writes one full snapshot, then only the changes
+    def __init__(self, itermin_saved, mode="full", compression=""):
+        self.itermin_saved = itermin_saved
+        self.mode = mode
+        self.compression = compression
+        self.previous = None
+        self._lock = threading.Lock()
+
+    def write(self, labels, class_ids):
+        with self._lock:
+            if self.mode == "differential" and self.previous is not None:
+                save_path = save_classification_diff(
+                    self.previous, labels, self.itermin_saved, self.compression
+                )
+            else:
+                save_path = save_classification_state(
+                    labels, class_ids, self.itermin_saved, self.compression
+                )
+            self.previous = labels
+            return save_path
+
+
+def read_full_snapshot(path):
+    import pandas as pd
+
+    df = pd.read_csv(path, dtype=str, encoding="utf-8-sig", index_col=0).fillna("")
+    labels = {file_name: set() for file_name in df.index}
+    class_columns = [column for column in df.columns if str(column).isdigit()]
+    if class_columns:
+        marked = df[class_columns].apply(lambda column: column.str.strip() != "")
+        marked = marked.stack()
+        for file_name, column in marked[marked].index:
+            labels[file_name].add(int(column))
+    return labels
+
+
+def read_snapshot(path):
+    # 차등 스냅샷은 직전 전체 스냅샷부터 순서대로 적용해 복원
+    if not is_diff_snapshot(path):
+        return read_full_snapshot(path)
+
+    folder = os.path.dirname(os.path.abspath(path))
+    chain = sorted(
+        name
+        for name in os.listdir(folder)
+        if name.startswith("saved_") and ".csv" in name
+    )
+    position = chain.index(os.path.basename(path))
+    base = position
+    while base >= 0 and is_diff_snapshot(chain[base]):
+        base -= 1
+    if base < 0:
+        raise ValueError(f"No full snapshot precedes {path}")
+
+    import pandas as pd
+
+    labels = read_full_snapshot(os.path.join(folder, chain[base]))
+    for name in chain[base + 1 : position + 1]:
+        changes = pd.read_csv(
+            os.path.join(folder, name), dtype={"file_name": str}, encoding="utf-8-sig"
+        )
+        for file_name, class_id, change in changes.itertuples(index=False):
+            class_ids = labels.setdefault(file_name, set())
+            if change == "+":
+                class_ids.add(int(class_id))
+            else:
+                class_ids.discard(int(class_id))
+    return labels
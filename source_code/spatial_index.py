@@ -0,0 +1,138 @@
+import os
+import numpy as np
+
+# 패치 좌표(x, y)는 WSI 기준 좌상단, 한 변의 길이는 patch_size (WSI 픽셀)
+# 가까운 패치 찾기와 겹치는 패치 쌍 찾기를 슬라이드별 균일 격자로 처리
+
+NEIGHBOR_CELLS = [(0, 1), (1, -1), (1, 0), (1, 1)]
+
+
+def patch_wsi_size(image_path=None):
+    # PATCH_WSI_SIZE가 없으면 패치 폭 x MAGNIFICATION_RATIO로 추정
+    configured = os.environ["PATCH_WSI_SIZE"]
+    if configured:
+        return int(configured)
+    if image_path is None:
+        raise ValueError("PATCH_WSI_SIZE is not set and no patch to measure")
+    from pyramid import source_size
+
+    width, _ = source_size(image_path)
+    if width <= 0:
+        raise ValueError(f"Cannot read the patch size of {image_path}")
+    return int(width * float(os.environ["MAGNIFICATION_RATIO"]))
+
+
+class SlideGrid:
+    # Rows of one slide bucketed by (x // cell_size, y // cell_size)
+    def __init__(self, rows, xs, ys, cell_size):
+        self.cell_size = cell_size
+        self.cells = {}
+        if not len(rows):
+            return
+        cell_xs = xs // cell_size
+        cell_ys = ys // cell_size
+        order = np.lexsort((cell_ys, cell_xs))
+        keys = np.stack([cell_xs[order], cell_ys[order]], axis=1)
+        starts = np.flatnonzero(np.any(np.diff(keys, axis=0) != 0, axis=1)) + 1
+        for cell_rows, key in zip(
+            np.split(rows[order], starts), keys[np.r_[0, starts]]
+        ):
+            self.cells[(int(key[0]), int(key[1]))] = cell_rows
+
+    def rows_near(self, x, y, distance):
+        # 거리 안에 걸칠 수 있는 격자 칸의 행만 후보로 모음
+        low_x = int((x - distance) // self.cell_size)
+        high_x = int((x + distance) // self.cell_size)
+        low_y = int((y - distance) // self.cell_size)
+        high_y = int((y + distance) // self.cell_size)
+        found = [
+            self.cells[(cell_x, cell_y)]
+            for cell_x in range(low_x, high_x + 1)
+            for cell_y in range(low_y, high_y + 1)
+            if (cell_x, cell_y) in self.cells
+        ]
+        if not found:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(found)
+
+    def candidate_pairs(self):
+        # 같은 칸과 "앞쪽" 이웃 칸만 보므로 각 쌍은 한 번씩만 나옴
+        for (cell_x, cell_y), cell_rows in self.cells.items():
+            if len(cell_rows) > 1:
+                first, second = np.triu_indices(len(cell_rows), 1)
+                yield cell_rows[first], cell_rows[second]
+            for offset_x, offset_y in NEIGHBOR_CELLS:
+                other = self.cells.get((cell_x + offset_x, cell_y + offset_y))
+                if other is not None:
+                    yield np.repeat(cell_rows, len(other)), np.tile(
+                        other, len(cell_rows)
+                    )
+
+
+class SpatialIndex:
+    # Per-slide grids over a PatchTable, built the first time a slide is queried
+    def __init__(self, patch_table, patch_size):
+        self.patch_table = patch_table
+        self.patch_size = patch_size
+        self.grids = {}
+
+    def grid(self, slide_code):
+        grid = self.grids.get(slide_code)
+        if grid is None:
+            table = self.patch_table
+            rows = np.flatnonzero(table.slide_codes == slide_code)
+            grid = SlideGrid(rows, table.xs[rows], table.ys[rows], self.patch_size)
+            self.grids[slide_code] = grid
+        return grid
+
+    def neighbors(self, row, distance):
+        # 같은 슬라이드에서 좌표 거리 distance 이내인 다른 패치, 가까운 순
+        table = self.patch_table
+        x, y = int(table.xs[row]), int(table.ys[row])
+        rows = self.grid(int(table.slide_codes[row])).rows_near(x, y, distance)
+        distances = np.hypot(table.xs[rows] - x, table.ys[rows] - y)
+        keep = (distances <= distance) & (rows != row)
+        rows, distances = rows[keep], distances[keep]
+        order = np.argsort(distances, kind="stable")
+        return rows[order], distances[order]
+
+    def overlapping_pairs(self, min_overlap=0.0, slide_code=None):
+        # (row_a, row_b, 겹친 면적 / 패치 면적), 겹침이 min_overlap보다 큰 쌍
+        table = self.patch_table
+        size = self.patch_size
+        slide_codes = (
+            range(len(table.slide_names)) if slide_code is None else [slide_code]
+        )
+        found_a, found_b, found_overlap = [], [], []
+        for code in slide_codes:
+            for rows_a, rows_b in self.grid(code).candidate_pairs():
+                width = size - np.abs(table.xs[rows_a] - table.xs[rows_b])
+                height = size - np.abs(table.ys[rows_a] - table.ys[rows_b])
+                overlap = np.clip(width, 0, None) * np.clip(height, 0, None) / size**2
+                keep = overlap > min_overlap
+                found_a.append(rows_a[keep])
+                found_b.append(rows_b[keep])
+                found_overlap.append(overlap[keep])
+        if not found_a:
+            return (
+                np.empty(0, dtype=np.int64),
+                np.empty(0, dtype=np.int64),
+                np.empty(0, dtype=np.float64),
+            )
+        return (
+            np.concatenate(found_a),
+            np.concatenate(found_b),
+            np.concatenate(found_overlap),
+        )
+
+    def redundant_rows(self, min_overlap=0.5):
+        # 겹치는 쌍마다 순위가 낮은(top-N의 N이 큰) 패치를 건너뛸 후보로 표시
+        rows_a, rows_b, overlap = self.overlapping_pairs(min_overlap)
+        ranks = self.patch_table.ranks
+        worse = np.where(ranks[rows_a] > ranks[rows_b], rows_a, rows_b)
+        better = np.where(ranks[rows_a] > ranks[rows_b], rows_b, rows_a)
+        redundant = {}
+        for row, kept, fraction in zip(worse.tolist(), better.tolist(), overlap):
+            if row not in redundant or fraction > redundant[row][1]:
+                redundant[row] = (kept, float(fraction))
+        return redundant
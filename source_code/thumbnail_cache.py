@@ -0,0 +1,92 @@
+import os
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QImage
+from image_cache import image_reader
+from patch_archive import patch_mtime_ns
+
+
+class ThumbnailCache:
+    # Thumbnails stored as JPEG files named after (patch path, mtime, size)
+    def __init__(self, cache_dir, size=128):
+        self.cache_dir = cache_dir  # None: generate every time, keep nothing
+        self.size = size
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def path_for(self, image_path):
+        key = f"{os.path.abspath(image_path)}|{patch_mtime_ns(image_path)}|{self.size}"
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], f"{digest}.jpg")
+
+    def load(self, image_path):
+        cached_path = None
+        if self.cache_dir:
+            try:
+                cached_path = self.path_for(image_path)
+            except OSError:
+                return None
+        if cached_path and os.path.exists(cached_path):
+            image = QImage(cached_path)
+            if not image.isNull():
+                return image
+
+        reader = image_reader(image_path)
+        source_size = reader.size()
+        if source_size.isValid():
+            reader.setScaledSize(
+                source_size.scaled(self.size, self.size, Qt.KeepAspectRatio)
+            )
+        image = reader.read()
+        if image.isNull():
+            return None
+        if not cached_path:
+            return image
+
+        os.makedirs(os.path.dirname(cached_path), exist_ok=True)
+        tmp_path = f"{cached_path}.{threading.get_ident()}.tmp"
+        if image.save(tmp_path, "JPG", 90):
+            os.replace(tmp_path, cached_path)
+        return image
+
+
+class ThumbnailLoader:
+    # Only the most recently requested rows stay queued
+    def __init__(self, cache, on_loaded, workers=4):
+        self.cache = cache
+        self.on_loaded = on_loaded
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="thumbnail"
+        )
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def request(self, rows_and_paths):
+        wanted = {row for row, _ in rows_and_paths}
+        with self._lock:
+            for row, future in list(self._futures.items()):
+                if row not in wanted and future.cancel():
+                    del self._futures[row]
+            for row, image_path in rows_and_paths:
+                if row not in self._futures:
+                    self._futures[row] = self._executor.submit(
+                        self._load, row, image_path
+                    )
+
+    def _load(self, row, image_path):
+        try:
+            image = self.cache.load(image_path)
+            if image is not None:
+                self.on_loaded(row, image)
+        finally:
+            with self._lock:
+                self._futures.pop(row, None)
+
+    def shutdown(self):
+        with self._lock:
+            for future in self._futures.values():
+                future.cancel()
+            self._futures.clear()
+        self._executor.shutdown(wait=True)
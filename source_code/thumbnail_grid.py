@@ -0,0 +1,88 @@
+import os
+from PyQt5.QtCore import Qt, QSize, QTimer, pyqtSignal
+from PyQt5.QtGui import QPixmap, QColor
+from PyQt5.QtWidgets import QListView, QAbstractItemView
+from image_cache import ImageCache, pixmap_bytes
+from patch_list_model import PatchListModel
+from thumbnail_cache import ThumbnailCache, ThumbnailLoader
+
+
+class ThumbnailModel(PatchListModel):
+    # Thumbnails are requested only for the rows a view actually paints
+    thumbnail_loaded = pyqtSignal(int, object)
+
+    def __init__(self, patch_table, label_index, images_path, parent=None):
+        super().__init__(patch_table, label_index, parent)
+        self.images_path = images_path
+        self.thumbnail_size = int(os.environ["THUMBNAIL_SIZE"])
+        self.thumbnails = ImageCache(
+            int(os.environ["THUMBNAIL_CACHE_MB"]) * 1024 * 1024,
+            size_of=pixmap_bytes,
+        )
+        self.loader = ThumbnailLoader(
+            ThumbnailCache(os.environ["THUMBNAIL_FOLDER"], self.thumbnail_size),
+            self.thumbnail_loaded.emit,  # 작업 스레드에서 호출되므로 시그널로 넘김
+            int(os.environ["THUMBNAIL_WORKERS"]),
+        )
+        self.thumbnail_loaded.connect(self.on_thumbnail_loaded)
+        label_index.add_listener(self.on_label_changed)
+
+        self.placeholder = QPixmap(self.thumbnail_size, self.thumbnail_size)
+        self.placeholder.fill(QColor("lightgray"))
+        self.wanted_rows = set()
+        self.request_timer = QTimer(self)
+        self.request_timer.setSingleShot(True)
+        self.request_timer.setInterval(30)
+        self.request_timer.timeout.connect(self.request_thumbnails)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.DecorationRole and index.isValid():
+            pixmap = self.thumbnails.get(index.row())
+            if pixmap is not None:
+                return pixmap
+            self.wanted_rows.add(index.row())
+            if not self.request_timer.isActive():
+                self.request_timer.start()
+            return self.placeholder
+        return super().data(index, role)
+
+    def request_thumbnails(self):
+        self.loader.request(
+            [
+                (row, self.patch_table.patch_path(self.images_path, row))
+                for row in sorted(self.wanted_rows)
+            ]
+        )
+        self.wanted_rows.clear()
+
+    def on_thumbnail_loaded(self, row, image):
+        self.thumbnails.put(row, QPixmap.fromImage(image))
+        self.dataChanged.emit(self.index(row), self.index(row), [Qt.DecorationRole])
+
+    def on_label_changed(self, file_name):
+        if file_name is None:
+            self.refresh_labels()
+            return
+        row = self.patch_table.row_of(file_name)
+        if row >= 0:
+            self.dataChanged.emit(self.index(row), self.index(row), [Qt.ForegroundRole])
+
+    def shutdown(self):
+        self.request_timer.stop()
+        self.loader.shutdown()
+
+
+class ThumbnailGrid(QListView):
+    def __init__(self, model, parent=None):
+        super().__init__(parent)
+        size = model.thumbnail_size
+        self.setViewMode(QListView.IconMode)
+        self.setResizeMode(QListView.Adjust)
+        self.setMovement(QListView.Static)
+        self.setUniformItemSizes(True)
+        self.setLayoutMode(QListView.Batched)
+        self.setBatchSize(200)
+        self.setIconSize(QSize(size, size))
+        self.setGridSize(QSize(size + 16, size + 32))
+        self.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.setModel(model)
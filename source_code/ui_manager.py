@@ -1,13 +1,21 @@
 import os
-from PyQt5.QtCore import Qt
+import time
+from PyQt5.QtCore import Qt, pyqtSignal
 from PyQt5.QtWidgets import QMainWindow, QShortcut, QHBoxLayout, QWidget
 from PyQt5.QtGui import QKeySequence
 from image_viewer import ImageViewer
 from classification_manager import ClassificationManager
-from functions import get_sorted_files, create_classification_csv
+from functions import stream_patch_table
+from annotation_store import open_annotation_store, sync_annotation_store
+from label_index import LabelIndex
+from patch_loader import PatchLoader
+from patch_table import PatchTable
+from instrumentation import measure, record
 
 
 class MainUI(QMainWindow):
+    labels_synced = pyqtSignal(object, int)
+
     def __init__(self):
         super().__init__()
 
@@ -15,8 +23,16 @@ class MainUI(QMainWindow):
         results_path = os.environ["RESULT_FOLDER"]
         intermin_saved = os.environ["INTERMIN_SAVED"]
 
-        image_files = get_sorted_files(images_path)
-        df = create_classification_csv(image_files, results_path)  # Database Initialize
+        self.images_path = images_path
+        self.results_path = results_path
+
+        # 패치 목록은 창을 띄운 뒤 슬라이드 단위로 채워짐
+        self.patch_table = PatchTable.from_records([])
+        # Database Initialize (class folders are reconciled once the list is complete)
+        with measure("startup.open_annotation_store"):
+            self.annotation_store = open_annotation_store()
+        with measure("startup.label_index"):
+            self.label_index = LabelIndex.from_store(self.annotation_store)
 
         # Setup UI
         self.base_width = 900
@@ -26,17 +42,69 @@ class MainUI(QMainWindow):
         self.resize(self.base_width, self.base_height)
         self.setMinimumSize(self.base_width, self.base_height)
 
-        self.image_viewer = ImageViewer(df, images_path)
-        self.classification_manager = ClassificationManager(
-            results_path,
-            intermin_saved,
-            self.image_viewer.get_current_image_path,
-        )
+        with measure("startup.image_viewer"):
+            self.image_viewer = ImageViewer(
+                self.patch_table,
+                images_path,
+                self.label_index,
+            )
+        with measure("startup.classification_manager"):
+            self.classification_manager = ClassificationManager(
+                results_path,
+                intermin_saved,
+                self.image_viewer.get_current_image_path,
+                self.annotation_store,
+                self.label_index,
+                self.image_viewer.get_selected_image_paths,
+            )
 
         self.setup_ui()
         self.shortcuts()
         self.image_viewer.image_changed.connect(self.update_classification_view)
 
+        self.loading_started = time.perf_counter()
+        self.patch_loader = PatchLoader(stream_patch_table(images_path), parent=self)
+        self.patch_loader.patches_loaded.connect(self.append_patches)
+        self.patch_loader.loading_finished.connect(self.finish_loading)
+        self.labels_synced.connect(self.apply_synced_labels)
+        self.patch_loader.start()
+
+    def append_patches(self, tables):
+        first = not len(self.patch_table)
+        self.image_viewer.append_patches(tables)
+        if first and len(self.patch_table):
+            record("startup.first_patch", time.perf_counter() - self.loading_started)
+
+    def finish_loading(self, tables):
+        record("startup.patch_list", time.perf_counter() - self.loading_started)
+        print(f"Loaded {len(self.patch_table)} patches")
+        if tables is None:
+            return
+        # 저장소 변경은 모두 write-behind 스레드에서 순서대로 실행
+        self.classification_manager.write_queue.submit(
+            "reconcile class folders",
+            self.sync_labels,
+            [name for table in tables for name in table.names],
+            self.label_index.version,
+        )
+
+    def sync_labels(self, names, version):
+        # 전체 목록이 모이면 클래스 폴더와 데이터베이스를 맞춤
+        if not sync_annotation_store(self.annotation_store, names, self.results_path):
+            return
+        labels = {
+            file_name: class_ids
+            for file_name, class_ids in self.annotation_store.items()
+            if class_ids
+        }
+        self.labels_synced.emit(labels, version)
+
+    def apply_synced_labels(self, labels, version):
+        if not self.label_index.replace(labels, version):
+            # 로딩 중에 라벨을 바꿨다면 폴더와 다시 비교
+            self.classification_manager.request_label_resync()
+        self.classification_manager.update_text_input_states()
+
     def setup_ui(self):
         self.update_widget_sizes()
 
@@ -63,6 +131,32 @@ class MainUI(QMainWindow):
         shortcut6 = QShortcut(QKeySequence("Ctrl+4"), self)
         shortcut6.activated.connect(lambda: self.click_button(3))
 
+        # Jump navigation
+        shortcut7 = QShortcut(QKeySequence("Ctrl+Down"), self)
+        shortcut7.activated.connect(self.image_viewer.show_next_unlabeled)
+        shortcut8 = QShortcut(QKeySequence("Ctrl+Up"), self)
+        shortcut8.activated.connect(lambda: self.image_viewer.show_next_unlabeled(-1))
+        shortcut9 = QShortcut(QKeySequence("Ctrl+Shift+Up"), self)
+        shortcut9.activated.connect(lambda: self.image_viewer.show_next_by_score(True))
+        shortcut10 = QShortcut(QKeySequence("Ctrl+Shift+Down"), self)
+        shortcut10.activated.connect(
+            lambda: self.image_viewer.show_next_by_score(False)
+        )
+        shortcut11 = QShortcut(QKeySequence("Ctrl+G"), self)
+        shortcut11.activated.connect(self.image_viewer.grid_button.toggle)
+        # Alt+N: 클래스 N의 다음 패치, Ctrl+Alt+N: 이전 패치
+        for class_id in range(1, 10):
+            next_in_class = QShortcut(QKeySequence(f"Alt+{class_id}"), self)
+            next_in_class.activated.connect(
+                lambda class_id=class_id: self.image_viewer.show_next_in_class(class_id)
+            )
+            previous_in_class = QShortcut(QKeySequence(f"Ctrl+Alt+{class_id}"), self)
+            previous_in_class.activated.connect(
+                lambda class_id=class_id: self.image_viewer.show_next_in_class(
+                    class_id, -1
+                )
+            )
+
     def click_button(self, button_index):
         # Make the button at button_index click
         if button_index < len(self.image_viewer.buttons):
@@ -88,6 +182,13 @@ class MainUI(QMainWindow):
     def update_classification_view(self, image_path):
         self.classification_manager.update_classification_status(image_path)
 
+    def closeEvent(self, event):
+        self.patch_loader.stop()
+        self.image_viewer.shutdown()
+        self.classification_manager.shutdown()  # 대기 중인 쓰기를 모두 반영
+        self.annotation_store.close()
+        super().closeEvent(event)
+
     def resizeEvent(self, event):
         self.update_widget_sizes()
         super().resizeEvent(event)
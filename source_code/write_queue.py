@@ -0,0 +1,65 @@
+import queue
+import threading
+import traceback
+
+
+class WriteBehindQueue:
+    # Applies filesystem/database mutations in submission order on one thread
+    def __init__(self, on_change=None):
+        self.on_change = on_change
+        self.failed = 0
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._jobs = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run, name="write-behind", daemon=True
+        )
+        self._thread.start()
+
+    def pending(self):
+        with self._lock:
+            return self._pending
+
+    def submit(self, description, func, *args, **kwargs):
+        if self._closed:
+            raise RuntimeError("write-behind queue is closed")
+        with self._lock:
+            self._pending += 1
+        self._jobs.put((description, func, args, kwargs))
+        self._notify()
+
+    def flush(self):
+        self._jobs.join()
+
+    def close(self):
+        # 남은 작업을 순서대로 모두 반영한 뒤 종료
+        if self._closed:
+            return
+        self._closed = True
+        self._jobs.put(None)
+        self._thread.join()
+
+    def _notify(self):
+        if self.on_change is not None:
+            self.on_change(self.pending(), self.failed)
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                self._jobs.task_done()
+                return
+
+            description, func, args, kwargs = job
+            try:
+                func(*args, **kwargs)
+            except Exception:
+                self.failed += 1
+                print(f"Write failed ({description}):")
+                traceback.print_exc()
+            finally:
+                with self._lock:
+                    self._pending -= 1
+                self._jobs.task_done()
+                self._notify()